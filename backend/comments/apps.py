@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class CommentsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'comments'
+
+    def ready(self):
+        from comments import metrics, signals  # noqa: F401
+
+        if settings.COMMENTS_METRICS_ENABLED:
+            metrics.enable()
@@ -0,0 +1,339 @@
+import asyncio
+import functools
+import json
+import math
+import multiprocessing
+import random
+import resource
+import time
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.db import connections
+
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from rest_framework_simplejwt.tokens import AccessToken
+
+from comments.consumers import CommentConsumer, save_and_broadcast
+from comments.db import query_observers
+from comments.encoding import JsonEncoding, MsgpackEncoding
+from comments.search import search_comments
+from comments.serializers import CommentListSerializer, comment_to_dict
+from comments.write_buffer import WriteBuffer
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+    def start(self):
+        query_observers.append(self)
+
+    def stop(self):
+        query_observers.remove(self)
+
+
+def percentile(values, percent):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(math.ceil(percent / 100 * len(ordered)) - 1, 0)]
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class BenchmarkClient:
+    def __init__(self, application, token, name):
+        self.communicator = WebsocketCommunicator(application, f"/ws/comments/?token={token}")
+        self.name = name
+        self.received = 0
+
+    async def connect(self):
+        connected, _ = await self.communicator.connect()
+        if not connected:
+            raise RuntimeError("Benchmark socket was rejected.")
+        await self.receive()
+
+    async def receive(self):
+        message = await self.communicator.receive_json_from(timeout=30)
+        self.received += 1
+        return message
+
+    async def list_comments(self, page_size):
+        await self.communicator.send_json_to({"action": "list_comments", "page_size": page_size})
+        while True:
+            message = await self.receive()
+            if message.get("action") == "list_comments" and "current_page" in message:
+                return message
+
+    async def create_comment(self, text):
+        await self.communicator.send_json_to({"action": "create_comment", "text": text})
+        while True:
+            message = await self.receive()
+            if "error" in message:
+                raise RuntimeError(message["error"])
+            if message.get("action") == "comment_created" and message["comment"]["text"] == text:
+                return message
+            if message.get("action") == "list_comments":
+                if any(comment["text"] == text for comment in message["comments"]):
+                    return message
+
+    async def drain(self):
+        while not await self.communicator.receive_nothing(timeout=0.2):
+            await self.receive()
+
+    async def disconnect(self):
+        await self.communicator.disconnect()
+
+
+@sync_to_async
+def create_benchmark_users(count, first=0):
+    users = []
+    for index in range(first, first + count):
+        user, _ = get_user_model().objects.get_or_create(
+            username=f"bench{index}", defaults={"email": f"bench{index}@example.com"}
+        )
+        users.append(str(AccessToken.for_user(user)))
+    return users
+
+
+async def measure_queries(action):
+    counter = QueryCounter()
+    # Consumers query from the pooled database threads, so the counter is
+    # attached to whatever connection each pooled call uses.
+    counter.start()
+    try:
+        await action()
+    finally:
+        counter.stop()
+    return counter.count
+
+
+async def collect_benchmark(
+    application, sockets=10, messages=20, create_ratio=0.2, page_size=25, seed=0, first_user=0, ready=None
+):
+    rng = random.Random(seed)
+    tokens = await create_benchmark_users(sockets, first_user)
+    clients = [
+        BenchmarkClient(application, token, f"client{first_user + index}")
+        for index, token in enumerate(tokens)
+    ]
+    for client in clients:
+        await client.connect()
+
+    probe = clients[0]
+    queries = {
+        "list_comments": await measure_queries(lambda: probe.list_comments(page_size)),
+        "create_comment": await measure_queries(lambda: probe.create_comment(f"{probe.name} probe")),
+    }
+    for client in clients:
+        await client.drain()
+    if ready is not None:
+        await ready()
+    for client in clients:
+        client.received = 0
+
+    latencies = defaultdict(list)
+
+    async def drive(client):
+        for index in range(messages):
+            if rng.random() < create_ratio:
+                action = "create_comment"
+                request = client.create_comment(f"{client.name} message {index}")
+            else:
+                action = "list_comments"
+                request = client.list_comments(page_size)
+            started = time.perf_counter()
+            await request
+            latencies[action].append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(drive(client) for client in clients))
+    for client in clients:
+        await client.drain()
+    elapsed = time.perf_counter() - started
+
+    for client in clients:
+        await client.disconnect()
+
+    return {
+        "sockets": sockets,
+        "elapsed_s": elapsed,
+        "messages_received": sum(client.received for client in clients),
+        "peak_rss_mb": peak_rss_mb(),
+        "latencies": dict(latencies),
+        "queries": queries,
+    }
+
+
+def summarize(*runs):
+    """Merge raw runs that were driven concurrently, e.g. one per worker process."""
+    elapsed = max(run["elapsed_s"] for run in runs)
+    received = sum(run["messages_received"] for run in runs)
+    actions = {}
+    for action in ("list_comments", "create_comment"):
+        samples = [sample for run in runs for sample in run["latencies"].get(action, [])]
+        actions[action] = {
+            "count": len(samples),
+            "p50_ms": percentile(samples, 50),
+            "p95_ms": percentile(samples, 95),
+            "p99_ms": percentile(samples, 99),
+            "queries": runs[0]["queries"][action],
+        }
+    return {
+        "workers": len(runs),
+        "sockets": sum(run["sockets"] for run in runs),
+        "elapsed_s": elapsed,
+        "messages_received": received,
+        "messages_per_s": received / elapsed if elapsed else 0.0,
+        "peak_rss_mb": max(run["peak_rss_mb"] for run in runs),
+        "actions": actions,
+    }
+
+
+async def run_benchmark(application, sockets=10, messages=20, create_ratio=0.2, page_size=25, seed=0):
+    return summarize(await collect_benchmark(
+        application, sockets, messages, create_ratio, page_size, seed
+    ))
+
+
+def _run_worker(application, barrier, results, index, options):
+    async def ready():
+        await asyncio.to_thread(barrier.wait)
+
+    try:
+        run = asyncio.run(collect_benchmark(
+            application, **{**options, "seed": options["seed"] + index},
+            first_user=index * options["sockets"], ready=ready
+        ))
+    except BaseException as exc:
+        barrier.abort()
+        results.put((index, repr(exc)))
+        raise
+    results.put((index, run))
+
+
+def run_multiprocess_benchmark(application, workers, **options):
+    """Drive ``workers`` forked copies of the application at once.
+
+    Each process serves its own sockets, so cross-process fan-out is only
+    exercised when the channel layer is shared (Redis), as in production.
+    """
+    context = multiprocessing.get_context("fork")
+    barrier = context.Barrier(workers)
+    results = context.Queue()
+    options.setdefault("seed", 0)
+    # Forked children must not share the parent's database sockets.
+    connections.close_all()
+    processes = [
+        context.Process(target=_run_worker, args=(application, barrier, results, index, options))
+        for index in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    runs = dict(results.get() for _ in processes)
+    for process in processes:
+        process.join()
+
+    failed = {index: run for index, run in runs.items() if isinstance(run, str)}
+    if failed:
+        raise RuntimeError(f"Benchmark workers failed: {failed}")
+    return summarize(*(runs[index] for index in sorted(runs)))
+
+
+ENCODING_PATHS = {
+    "drf+json": lambda comments: json.dumps(CommentListSerializer(comments, many=True).data),
+    "dict+orjson": lambda comments: JsonEncoding.encode([comment_to_dict(c) for c in comments]),
+    "dict+msgpack": lambda comments: MsgpackEncoding.encode([comment_to_dict(c) for c in comments]),
+}
+
+
+def compare_encodings(comments, rounds=200):
+    """Time each serialize-and-encode path over already loaded reply trees."""
+    results = {}
+    for name, encode in ENCODING_PATHS.items():
+        encode(comments)
+        started = time.perf_counter()
+        for _ in range(rounds):
+            frame = encode(comments)
+        elapsed = time.perf_counter() - started
+        results[name] = {"us_per_page": elapsed / rounds * 1e6, "bytes": len(frame)}
+    return results
+
+
+def measure_search(words, queries=200, page_size=25, seed=0):
+    rng = random.Random(seed)
+    latencies = []
+    for _ in range(queries):
+        query = " ".join(rng.sample(words[:500], rng.randint(1, 2)))
+        started = time.perf_counter()
+        search_comments(query, page_size)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return {
+        "queries": queries,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+    }
+
+
+async def measure_writes(comments=2000, senders=50, window=0.005, batch_size=100, reply_ratio=0.5, seed=0):
+    """
+    Comments saved and broadcast per second, one at a time versus through a
+    WriteBuffer, with ``senders`` concurrent writers that each wait for their
+    own result like a socket does.
+    """
+    user = (await sync_to_async(get_user_model().objects.get_or_create)(
+        username="bench-writer", defaults={"email": "bench-writer@example.com"}
+    ))[0]
+    consumer = CommentConsumer()
+    consumer.scope = {"user": user}
+    consumer.channel_layer = get_channel_layer()
+    roots = [await consumer.save_comment(user, f"root {index}", None, None, None) for index in range(10)]
+    buffer = WriteBuffer(window, batch_size, functools.partial(save_and_broadcast, consumer.channel_layer))
+
+    async def save_direct(request):
+        comment = await consumer.save_comment(*request)
+        await consumer.broadcast_new_comment(comment)
+
+    async def save_buffered(request):
+        await buffer.submit(request)
+
+    results = {}
+    for mode, save in (("direct", save_direct), ("buffered", save_buffered)):
+        rng = random.Random(seed)
+        latencies = []
+
+        async def send(count):
+            for index in range(count):
+                reply_id = rng.choice(roots).pk if rng.random() < reply_ratio else None
+                started = time.perf_counter()
+                await save((user, f"{mode} {index}", None, reply_id, None))
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        counter = QueryCounter()
+        counter.start()
+        started = time.perf_counter()
+        try:
+            await asyncio.gather(*(
+                send(comments // senders + (index < comments % senders)) for index in range(senders)
+            ))
+        finally:
+            counter.stop()
+        elapsed = time.perf_counter() - started
+        results[mode] = {
+            "comments_per_s": comments / elapsed,
+            "queries_per_comment": counter.count / comments,
+            "p50_ms": percentile(latencies, 50),
+            "p99_ms": percentile(latencies, 99),
+        }
+    return results
+
@@ -0,0 +1,37 @@
+import asyncio
+
+from comments.loop_registry import per_loop
+
+
+class Coalescer:
+    # Runs flush at most once per window: the first trigger runs right away,
+    # triggers during the window are merged into a single trailing run.
+
+    def __init__(self, window, flush):
+        self.window = window
+        self.flush = flush
+        self.last_run = None
+        self.task = None
+
+    def trigger(self):
+        if self.task is not None:
+            return
+        loop = asyncio.get_running_loop()
+        delay = 0 if self.last_run is None else self.last_run + self.window - loop.time()
+        self.task = loop.create_task(self.run(max(delay, 0)))
+
+    async def run(self, delay):
+        if delay:
+            await asyncio.sleep(delay)
+        self.task = None
+        self.last_run = asyncio.get_running_loop().time()
+        await self.flush()
+
+    def cancel(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+
+def group_coalescer(group, window, flush):
+    return per_loop(Coalescer, group, window=window, flush=flush)
@@ -1,45 +1,182 @@
+import asyncio
+import functools
 import json
+import time
+from collections import defaultdict
 
+from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.paginator import EmptyPage, Paginator
 from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce, Greatest
 
 from rest_framework.exceptions import ValidationError
 
-from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
 
+from comments import metrics
+from comments.coalescing import Coalescer, group_coalescer
+from comments.db import pooled_database_sync_to_async
+from comments.encoding import ENCODINGS, JsonEncoding, encode_all, negotiate
+from comments.frames import parse_upload_frame
+from comments.images import process_base64_image, process_image_frame, store_image
 from comments.models import Comment
-from comments.serializers import CommentListSerializer
-from comments.utils import convert_base64_to_image
+from comments.outbox import Outbox, OutboxFull
+from comments.page_cache import cached_page
+from comments.routers import reads_from_replica
+from comments.search import search_comments
+from comments.pagination import approximate_count_pages, keyset_paginate, parse_page_size, parse_replies_limit
+from comments.sequence import (
+    ROOTS_TOPIC,
+    comment_topic,
+    current_epoch,
+    current_topic_sequences,
+    current_version,
+    next_sequence,
+    thread_topic,
+)
+from comments.serializers import comment_to_dict, format_datetime
+from comments.throttling import ConnectionThrottle
+from comments.tree import load_reply_trees
+from comments.write_buffer import write_buffer
 
 
 class CommentConsumer(AsyncWebsocketConsumer):
     SORTING = {
-        "username": "user__username",
-        "email": "user__email",
+        "username": "author_username",
+        "email": "author_email",
         "date": "created_at"
     }
+    # Field of comment_to_dict() each sort orders by.
+    SORT_KEYS = {
+        "username": "username",
+        "email": "email",
+        "date": "created_at"
+    }
+    ACTIONS = (
+        "list_comments", "create_comment", "load_replies", "search_comments", "subscribe_thread",
+        "unsubscribe_thread"
+    )
+    CLOSE_RATE_LIMITED = 4029
+    CLOSE_SLOW_CONSUMER = 4008
+
+    outbox = None
+    page_refresh = None
+    pending_page = None
+    page_group = None
+    page_last_key = None
+    encoding = JsonEncoding
+    counted = False
 
     async def connect(self):
         if not self.scope['user'].is_authenticated:
             await self.close()
         else:
-            self.room_name = "chat_room"
             self.current_sort_by = "date"
             self.current_sort_order = "desc"
-            await self.channel_layer.group_add(self.room_name, self.channel_name)
-            await self.accept()
+            self.replies_limit = settings.COMMENTS_REPLIES_LIMIT
+            self.thread_groups = set()
+            self.explicit_thread_groups = set()
+            self.throttle = ConnectionThrottle(self.scope["user"].pk)
+            self.throttled_messages = 0
+            self.encoding = negotiate(self.scope.get("subprotocols", []))
+            await self.accept(subprotocol=self.encoding.subprotocol)
+            self.outbox = Outbox(self.write, settings.COMMENTS_OUTBOX_SIZE)
+            self.outbox_task = asyncio.ensure_future(self.outbox.run())
+            self.counted = True
+            metrics.connection_opened()
             await self.send_comments_list()
 
-    @database_sync_to_async
-    def get_comments_from_db(self, page, page_size, sort_by, sort_order):
+    async def disconnect(self, code):
+        if self.counted:
+            self.counted = False
+            metrics.connection_closed()
+        if self.page_refresh is not None:
+            self.page_refresh.cancel()
+        if self.outbox is not None:
+            self.outbox_task.cancel()
+        if self.page_group is not None:
+            await self.channel_layer.group_discard(self.page_group, self.channel_name)
+        for group in getattr(self, "thread_groups", ()):
+            await self.channel_layer.group_discard(group, self.channel_name)
+
+    @staticmethod
+    def page_group_name(page_key):
+        return "comments.page." + page_key.replace(":", ".")
+
+    @staticmethod
+    def thread_group_name(thread_id):
+        return f"comments.thread.{thread_id}"
+
+    async def subscribe(self, page_key, root_ids, last_key=None):
+        page_group = self.page_group_name(page_key) if page_key else None
+        self.page_last_key = last_key if page_group else None
+        if page_group != self.page_group:
+            # A refresh queued for the old page must not overwrite the new one.
+            if self.page_refresh is not None:
+                self.page_refresh.cancel()
+            self.pending_page = None
+            if self.page_group is not None:
+                await self.channel_layer.group_discard(self.page_group, self.channel_name)
+            if page_group is not None:
+                await self.channel_layer.group_add(page_group, self.channel_name)
+            self.page_group = page_group
+
+        thread_groups = {self.thread_group_name(root_id) for root_id in root_ids}
+        thread_groups |= self.explicit_thread_groups
+        for group in self.thread_groups - thread_groups:
+            await self.channel_layer.group_discard(group, self.channel_name)
+        for group in thread_groups - self.thread_groups:
+            await self.channel_layer.group_add(group, self.channel_name)
+        self.thread_groups = thread_groups
+
+    async def write(self, text_data=None, bytes_data=None, close=False):
+        metrics.count_outbound(text_data, bytes_data)
+        await super().send(text_data=text_data, bytes_data=bytes_data, close=close)
+
+    async def send(self, text_data=None, bytes_data=None, close=False, coalesce=None):
+        if self.outbox is None or close:
+            await self.write(text_data=text_data, bytes_data=bytes_data, close=close)
+            return
+        try:
+            self.outbox.push(text_data, bytes_data, coalesce)
+        except OutboxFull:
+            self.outbox_task.cancel()
+            self.outbox = None
+            await self.close(code=self.CLOSE_SLOW_CONSUMER)
+
+    async def send_message(self, payload, coalesce=None):
+        await self.send_frame({self.encoding.name: self.encoding.encode(payload)}, coalesce)
+
+    async def send_frame(self, frames, coalesce=None):
+        await self.send(**self.encoding.frame(frames[self.encoding.name]), coalesce=coalesce)
+
+    async def check_rate_limit(self, action):
+        allowed, retry_after = await self.throttle.consume(action)
+        if allowed:
+            self.throttled_messages = 0
+            return True
+        self.throttled_messages += 1
+        if self.throttled_messages >= settings.COMMENTS_THROTTLE_CLOSE_AFTER:
+            await self.close(code=self.CLOSE_RATE_LIMITED)
+        else:
+            await self.send_message({
+                "error": "Rate limit exceeded",
+                "action": action,
+                "retry_after": round(retry_after, 3)
+            })
+        return False
+
+    def fetch_roots(self, page, page_size, sort_by, sort_order):
         sort = self.SORTING.get(sort_by, "created_at")
         order_prefix = '' if sort_order == 'asc' else '-'
         sort_field_with_order = f'{order_prefix}{sort}'
 
         paginator = Paginator(
-            Comment.objects.filter(reply=None).select_related("user").order_by(sort_field_with_order),
+            Comment.objects.filter(reply=None).order_by(
+                sort_field_with_order, f'{order_prefix}pk'
+            ),
             page_size
         )
         try:
@@ -47,96 +184,660 @@ class CommentConsumer(AsyncWebsocketConsumer):
         except EmptyPage:
             paginated_comments = paginator.get_page(
                 paginator.num_pages)
-        return CommentListSerializer(paginated_comments, many=True).data, paginator.num_pages
+        return list(paginated_comments), paginator.num_pages
+
+    def fetch_comments(self, page, page_size, sort_by, sort_order, replies_limit=None, public=False):
+        roots, count_pages = self.fetch_roots(page, page_size, sort_by, sort_order)
+        return self.comment_trees(roots, replies_limit, public), count_pages
+
+    @staticmethod
+    def comment_trees(roots, replies_limit, public=False):
+        return [comment_to_dict(comment, public) for comment in load_reply_trees(roots, replies_limit)]
+
+    @staticmethod
+    def read_page(fetch_roots, replies_limit, public=False):
+        """
+        (comments, seqs, *rest) for the roots from ``fetch_roots()``, which
+        returns (roots, *rest).
+
+        Every seq is read before the rows it covers: a comment committed in
+        between then shows up in the page ahead of its seq (the client drops
+        the duplicate event) instead of being counted but missing.
+        """
+        seqs = current_topic_sequences([ROOTS_TOPIC])
+        roots, *rest = fetch_roots()
+        seqs.update(current_topic_sequences([thread_topic(root.pk) for root in roots]))
+        return CommentConsumer.comment_trees(roots, replies_limit, public), seqs, *rest
+
+    def render_comments_page(self, page, page_size, sort_by, sort_order, encodings=None, replies_limit=None,
+                             version=None, public=False):
+        def render(version):
+            epoch, seq = version
+            comments, seqs, count_pages = self.read_page(
+                lambda: self.fetch_roots(page, page_size, sort_by, sort_order), replies_limit, public
+            )
+            payload = {
+                "action": "list_comments",
+                "comments": comments,
+                "count_pages": count_pages,
+                "current_page": page,
+                "epoch": epoch,
+                "seq": seq,
+                "seqs": seqs
+            }
+            root_ids = [comment["id"] for comment in comments]
+            return payload, (root_ids, self.last_sort_key(comments, page_size, sort_by))
+
+        cache_key = self.page_key(sort_by, sort_order)
+        if replies_limit is not None:
+            cache_key = f"{cache_key}:{replies_limit}"
+        if public:
+            cache_key = f"{cache_key}:public"
+        return cached_page(cache_key, page, page_size, render, encodings or (self.encoding,), version)
+
+    @classmethod
+    def last_sort_key(cls, comments, page_size, sort_by):
+        """Sort key of a full page's last root; None when any new root fits on the page."""
+        if not comments or len(comments) < page_size:
+            return None
+        return comments[-1][cls.SORT_KEYS.get(sort_by, "created_at")]
+
+    @pooled_database_sync_to_async
+    @reads_from_replica
+    def get_comments_from_db(self, page, page_size, sort_by, sort_order, replies_limit=None):
+        return self.render_comments_page(
+            page, page_size, sort_by, sort_order, replies_limit=replies_limit
+        )
+
+    def fetch_roots_by_cursor(self, cursor, page_size, sort_by, sort_order, with_count):
+        roots, next_cursor, prev_cursor = keyset_paginate(
+            Comment.objects.filter(reply=None),
+            self.SORTING.get(sort_by, "created_at"),
+            sort_order != "asc",
+            page_size,
+            cursor
+        )
+        count_pages = approximate_count_pages(page_size) if with_count else None
+        return roots, next_cursor, prev_cursor, count_pages
+
+    def fetch_comments_by_cursor(self, cursor, page_size, sort_by, sort_order, with_count, replies_limit=None):
+        roots, next_cursor, prev_cursor, count_pages = self.fetch_roots_by_cursor(
+            cursor, page_size, sort_by, sort_order, with_count
+        )
+        return self.comment_trees(roots, replies_limit), next_cursor, prev_cursor, count_pages
+
+    @pooled_database_sync_to_async
+    @reads_from_replica
+    def get_comments_by_cursor_from_db(self, cursor, page_size, sort_by, sort_order, with_count,
+                                       replies_limit=None):
+        version = current_version()
+        comments, seqs, next_cursor, prev_cursor, count_pages = self.read_page(
+            lambda: self.fetch_roots_by_cursor(cursor, page_size, sort_by, sort_order, with_count), replies_limit
+        )
+        return comments, next_cursor, prev_cursor, count_pages, version, seqs
+
+    @classmethod
+    def page_key(cls, sort_by, sort_order):
+        sort_by = sort_by if sort_by in cls.SORTING else "date"
+        sort_order = "asc" if sort_order == "asc" else "desc"
+        return f"{sort_by}:{sort_order}"
+
+    # Always on the primary: it runs right after a write, for every socket.
+    @pooled_database_sync_to_async
+    def render_first_pages(self, page_size=25):
+        pages = {}
+        for sort_by in self.SORTING:
+            for sort_order in ("asc", "desc"):
+                pages[self.page_key(sort_by, sort_order)], _ = self.render_comments_page(
+                    1, page_size, sort_by, sort_order, ENCODINGS, settings.COMMENTS_REPLIES_LIMIT
+                )
+        return pages
+
+    @pooled_database_sync_to_async
+    def render_comment_created(self, comment):
+        return self.comment_created_frames(comment)
+
+    @staticmethod
+    def comment_created_frames(comment):
+        comment.loaded_replies = []
+        data = comment_to_dict(comment)
+        return encode_all({
+            "action": "comment_created",
+            "topic": comment_topic(comment),
+            "epoch": comment.epoch,
+            "seq": comment.seq,
+            "version": comment.version,
+            "thread_id": comment.thread_id,
+            "parent_id": comment.reply_id,
+            "comment": data,
+            "sort_keys": CommentConsumer.comment_sort_keys(comment)
+        })
+
+    @staticmethod
+    def comment_sort_keys(comment):
+        return {
+            "username": comment.author_username,
+            "email": comment.author_email,
+            "date": format_datetime(comment.created_at)
+        }
 
     async def send_comments_list(self, page=1, page_size=25, sort_by="date", sort_order="desc"):
-        comments, count_pages = await self.get_comments_from_db(page, page_size, sort_by, sort_order)
-        await self.send(text_data=json.dumps({
+        frames, (root_ids, last_key) = await self.get_comments_from_db(
+            page, page_size, sort_by, sort_order, self.replies_limit
+        )
+        first_page = page in (1, "1")
+        await self.subscribe(self.page_key(sort_by, sort_order) if first_page else None, root_ids, last_key)
+        await self.send_frame(frames, coalesce="list_comments")
+
+    async def send_comments_cursor_page(self, cursor=None, page_size=25, sort_by="date",
+                                        sort_order="desc", with_count=False):
+        comments, next_cursor, prev_cursor, count_pages, (epoch, seq), seqs = await self.get_comments_by_cursor_from_db(
+            cursor, page_size, sort_by, sort_order, with_count, self.replies_limit
+        )
+        await self.subscribe(
+            self.page_key(sort_by, sort_order) if cursor is None else None,
+            [comment["id"] for comment in comments],
+            self.last_sort_key(comments, page_size, sort_by)
+        )
+        await self.send_message({
             "action": "list_comments",
             "comments": comments,
+            "next_cursor": next_cursor,
+            "prev_cursor": prev_cursor,
             "count_pages": count_pages,
-            "current_page": page
-        }))
+            "epoch": epoch,
+            "seq": seq,
+            "seqs": seqs
+        }, coalesce="list_comments")
 
     async def receive(self, text_data=None, bytes_data=None):
         if text_data is not None:
             data = json.loads(text_data)
-            text = data.get("text")
-            home_page = data.get("home_page")
-            reply_id = data.get("reply_id")
-            image = data.get("image", None)
+            action = data.get("action") if data.get("action") in self.ACTIONS else "unknown"
+            with metrics.observe_message(action):
+                await self.receive_action(data)
+        elif bytes_data is not None:
+            with metrics.observe_message("create_comment"):
+                await self.receive_upload(bytes_data)
+
+    async def receive_action(self, data):
+        image = data.get("image", None)
+        if not await self.check_rate_limit(data.get("action")):
+            return
 
-            if image:
+        if data.get("action") == "list_comments":
+            self.current_sort_by = data.get("sort_by", "date")
+            self.current_sort_order = data.get("sort_order", "desc")
+            if "replies_limit" in data:
                 try:
-                    image = await database_sync_to_async(convert_base64_to_image)(image)
+                    self.replies_limit = parse_replies_limit(data["replies_limit"])
                 except ValidationError as e:
-                    await self.send(text_data=json.dumps({"error": str(e)}))
+                    await self.send_message({"error": str(e.detail[0])})
                     return
-
-
-            if data.get("action") == "list_comments":
-                self.current_sort_by = data.get("sort_by", "date")
-                self.current_sort_order = data.get("sort_order", "desc")
+            try:
+                page_size = parse_page_size(data.get("page_size"))
+            except ValidationError as e:
+                await self.send_message({"error": str(e.detail[0])})
+                return
+            if data.get("pagination") == "cursor":
+                try:
+                    await self.send_comments_cursor_page(
+                        cursor=data.get("cursor"),
+                        page_size=page_size,
+                        sort_by=self.current_sort_by,
+                        sort_order=self.current_sort_order,
+                        with_count=data.get("with_count", False)
+                    )
+                except ValidationError as e:
+                    await self.send_message({"error": str(e.detail[0])})
+            else:
                 await self.send_comments_list(
                     page=data.get("page", 1),
-                    page_size=data.get("page_size", 25),
+                    page_size=page_size,
                     sort_by=self.current_sort_by,
                     sort_order=self.current_sort_order
                 )
 
-            elif data.get("action") == "create_comment":
-                if text:
-                    await self.create_comment(text, home_page, reply_id, image)
-                    await self.channel_layer.group_send(
-                        self.room_name,
-                        {
-                            "type": "broadcast_comments",
-                            "sort_by": self.current_sort_by,
-                            "sort_order": self.current_sort_order,
-                        }
-                    )
-                elif not text or text.strip() == "":
-                    await self.send(text_data=json.dumps({
-                        "error": "Comment text cannot be empty"
-                    }))
+        elif data.get("action") == "create_comment":
+            upload = (lambda: process_base64_image(image)) if image else None
+            await self.create_comment_from_message(data, upload)
+
+        elif data.get("action") == "load_replies":
+            try:
+                await self.send_replies(
+                    parent_id=data.get("parent_id"),
+                    cursor=data.get("cursor"),
+                    page_size=data.get("page_size")
+                )
+            except ValidationError as e:
+                await self.send_message({"error": str(e.detail[0])})
+
+        elif data.get("action") == "search_comments":
+            try:
+                await self.send_search_results(
+                    query=data.get("query"),
+                    cursor=data.get("cursor"),
+                    page_size=data.get("page_size")
+                )
+            except ValidationError as e:
+                await self.send_message({"error": str(e.detail[0])})
+
+        elif data.get("action") in ("subscribe_thread", "unsubscribe_thread"):
+            await self.update_thread_subscription(data)
+
+    async def receive_upload(self, bytes_data):
+        if not await self.check_rate_limit("create_comment"):
+            return
+        try:
+            data, image_offset = parse_upload_frame(bytes_data)
+        except ValidationError as e:
+            await self.send_message({"error": str(e.detail[0])})
+            return
+        if data.get("action") != "create_comment":
+            await self.send_message({"error": "Unsupported binary frame action."})
+            return
+        if image_offset < len(bytes_data):
+            upload = lambda: process_image_frame(bytes_data, image_offset)
+        else:
+            upload = None
+        await self.create_comment_from_message(data, upload)
+
+    def fetch_replies(self, parent_id, cursor, page_size, replies_limit):
+        replies, next_cursor, _ = keyset_paginate(
+            Comment.objects.filter(reply_id=parent_id), "created_at", False, page_size, cursor
+        )
+        replies = load_reply_trees(replies, replies_limit)
+        return [comment_to_dict(reply) for reply in replies], next_cursor
+
+    @pooled_database_sync_to_async
+    @reads_from_replica
+    def get_replies_from_db(self, parent_id, cursor, page_size, replies_limit):
+        return self.fetch_replies(parent_id, cursor, page_size, replies_limit)
+
+    async def send_replies(self, parent_id, cursor=None, page_size=25):
+        try:
+            parent_id = int(parent_id)
+        except (TypeError, ValueError):
+            raise ValidationError("Invalid parent_id.")
+        replies, next_cursor = await self.get_replies_from_db(
+            parent_id, cursor, parse_page_size(page_size), self.replies_limit
+        )
+        await self.send_message({
+            "action": "load_replies",
+            "parent_id": parent_id,
+            "replies": replies,
+            "next_cursor": next_cursor
+        })
+
+    async def send_search_results(self, query, cursor=None, page_size=25):
+        results, next_cursor = await pooled_database_sync_to_async(reads_from_replica(search_comments))(
+            query, parse_page_size(page_size), cursor
+        )
+        await self.send_message({
+            "action": "search_comments",
+            "query": query,
+            "results": results,
+            "next_cursor": next_cursor
+        })
+
+    # On the primary: the root may have been posted a moment ago.
+    @staticmethod
+    @pooled_database_sync_to_async
+    def is_root(root_id):
+        return Comment.objects.filter(pk=root_id, reply=None).exists()
+
+    async def update_thread_subscription(self, data):
+        try:
+            root_id = int(data.get("root_id"))
+        except (TypeError, ValueError):
+            await self.send_message({"error": "Invalid root_id."})
+            return
+
+        group = self.thread_group_name(root_id)
+        if data["action"] == "subscribe_thread" and group not in self.explicit_thread_groups:
+            if len(self.explicit_thread_groups) >= settings.COMMENTS_MAX_THREAD_SUBSCRIPTIONS:
+                await self.send_message({"error": "Too many thread subscriptions."})
+                return
+            if not await self.is_root(root_id):
+                await self.send_message({"error": "Thread not found."})
+                return
+
+        if data["action"] == "subscribe_thread":
+            self.explicit_thread_groups.add(group)
+            if group not in self.thread_groups:
+                await self.channel_layer.group_add(group, self.channel_name)
+                self.thread_groups.add(group)
+        else:
+            self.explicit_thread_groups.discard(group)
+            if group in self.thread_groups:
+                await self.channel_layer.group_discard(group, self.channel_name)
+                self.thread_groups.discard(group)
+
+        topic = thread_topic(root_id)
+        await self.send_message({
+            "action": data["action"],
+            "root_id": root_id,
+            "epoch": await pooled_database_sync_to_async(current_epoch)(),
+            "seqs": await pooled_database_sync_to_async(current_topic_sequences)([topic])
+        })
+
+    async def create_comment_from_message(self, data, upload=None):
+        text = data.get("text")
+        if not text:
+            await self.send_message({
+                "error": "Comment text cannot be empty"
+            })
+            return
+
+        image = None
+        if upload is not None:
+            try:
+                image = await upload()
+            except ValidationError as e:
+                await self.send_message({"error": str(e.detail[0])})
+                return
+        if settings.COMMENTS_WRITE_BUFFER_WINDOW:
+            comment = await self.create_buffered_comment(text, data.get("home_page"), data.get("reply_id"), image)
+        else:
+            comment = await self.create_comment(text, data.get("home_page"), data.get("reply_id"), image)
+            if comment is not None:
+                await self.broadcast_new_comment(comment)
+        if comment is not None:
+            await self.send_comment_saved(comment)
+
+    async def send_comment_saved(self, comment):
+        # Only the sender gets this; everyone, the sender included, also gets
+        # the comment_created broadcast.
+        await self.send_message({
+            "action": "comment_saved",
+            "id": comment.id,
+            "topic": comment_topic(comment),
+            "epoch": comment.epoch,
+            "seq": comment.seq
+        })
 
     @staticmethod
     def create_comment_in_transaction(user, text, home_page, reply_comment=None, image=None):
+        image_srcset = None
+        if image is not None:
+            # Files are content-addressed, so ones left by a rolled back
+            # comment are simply reused by the next upload of that image.
+            image_srcset = image.srcset
+            image = store_image(image, Comment._meta.get_field("image").storage)
         with transaction.atomic():
-            Comment.objects.create(
+            comment = Comment.objects.create(
                 user=user,
                 text=text,
                 home_page=home_page,
                 reply=reply_comment,
-                image=image
+                image=image,
+                image_srcset=image_srcset
             )
 
+            def assign_sequence():
+                comment.version, comment.seq = next_sequence(comment_topic(comment))
+                comment.epoch = current_epoch()
+
+            transaction.on_commit(assign_sequence)
+        return comment
+
+    @staticmethod
+    def create_comments_in_transaction(requests):
+        """
+        Insert (user, text, home_page, reply_id, image) requests with one
+        parent lookup and one bulk insert; returns a Comment or an
+        exception per request.
+
+        If the bulk insert fails, the rows are retried one by one so a bad
+        request only fails itself.
+        """
+        def parse_id(value):
+            try:
+                return int(value)
+            except (TypeError, ValueError):
+                return None
+
+        results = []
+        parents = Comment.objects.in_bulk(
+            {parse_id(reply_id) for _, _, _, reply_id, _ in requests if reply_id} - {None}
+        )
+        storage = Comment._meta.get_field("image").storage
+        for user, text, home_page, reply_id, image in requests:
+            parent = parents.get(parse_id(reply_id)) if reply_id else None
+            if reply_id and parent is None:
+                results.append(Comment.DoesNotExist())
+                continue
+            try:
+                stored_image = store_image(image, storage) if image is not None else None
+            except Exception as e:
+                results.append(e)
+                continue
+            results.append(Comment(
+                user=user,
+                author_username=user.username,
+                author_email=user.email,
+                text=text,
+                home_page=home_page,
+                reply=parent,
+                root_id=parent.thread_id if parent else None,
+                image=stored_image,
+                image_srcset=image.srcset if image is not None else None
+            ))
+        comments = [comment for comment in results if isinstance(comment, Comment)]
+        if not comments:
+            return results
+
+        try:
+            with transaction.atomic():
+                CommentConsumer.insert_comments(comments)
+        except Exception:
+            for index, comment in enumerate(results):
+                if not isinstance(comment, Comment):
+                    continue
+                comment.pk = None
+                try:
+                    with transaction.atomic():
+                        CommentConsumer.insert_comments([comment])
+                except Exception as e:
+                    results[index] = e
+        return results
+
+    @staticmethod
+    def insert_comments(comments):
+        Comment.objects.bulk_create(comments)
+        # bulk_create skips the post_save signal that counts replies.
+        replies = defaultdict(list)
+        for comment in comments:
+            if comment.reply_id is not None:
+                replies[comment.reply_id].append(comment.created_at)
+        for reply_id, created_at in replies.items():
+            latest = Value(max(created_at))
+            Comment.objects.filter(pk=reply_id).update(
+                reply_count=F("reply_count") + len(created_at),
+                last_reply_at=Greatest(Coalesce("last_reply_at", latest), latest)
+            )
+
+        def assign_sequences():
+            for comment in comments:
+                comment.version, comment.seq = next_sequence(comment_topic(comment))
+            epoch = current_epoch()
+            for comment in comments:
+                comment.epoch = epoch
+
+        transaction.on_commit(assign_sequences)
+
+    async def create_buffered_comment(self, text, home_page=None, reply_id=None, image=None):
+        # Creates from every socket of this process within the window share
+        # one transaction and one broadcast (see COMMENTS_WRITE_BUFFER_WINDOW).
+        buffer = write_buffer(
+            "comments.create",
+            settings.COMMENTS_WRITE_BUFFER_WINDOW,
+            settings.COMMENTS_WRITE_BUFFER_SIZE,
+            functools.partial(save_and_broadcast, self.channel_layer)
+        )
+        try:
+            return await buffer.submit((self.scope["user"], text, home_page, reply_id, image))
+        except ObjectDoesNotExist:
+            await self.send_message({
+                "error": "Comment not found"
+            })
+        except Exception:
+            await self.send_message({
+                "error": "An error occurred while creating comment."
+            })
+
+    @pooled_database_sync_to_async
+    def save_comment(self, user, text, home_page, reply_id, image):
+        reply_comment = Comment.objects.get(pk=reply_id) if reply_id else None
+        return self.create_comment_in_transaction(user, text, home_page, reply_comment, image)
+
     async def create_comment(self, text, home_page=None, reply_id=None, image=None):
         user = self.scope["user"]
         if user.is_authenticated:
             try:
-                reply_comment = None
-                if reply_id:
-                    reply_comment = await database_sync_to_async(
-                        Comment.objects.get
-                    )(pk=reply_id)
-
-                await (database_sync_to_async(self.create_comment_in_transaction)
-                       (user, text, home_page, reply_comment, image))
+                return await self.save_comment(user, text, home_page, reply_id, image)
 
             except ObjectDoesNotExist:
-                await self.send(text_data=json.dumps({
+                await self.send_message({
                     "error": "Comment not found"
-                }))
+                })
             except Exception as e:
-                await self.send(text_data=json.dumps({
+                await self.send_message({
                     "error": f"An error occurred while creating comment."
-                }))
+                })
+
+    async def broadcast_new_comment(self, comment):
+        if settings.COMMENTS_BROADCAST_MODE == "page":
+            refresh_first_pages(self.channel_layer)
+            return
+
+        started = time.perf_counter()
+        event = {
+            "type": "comment_created",
+            "frames": await self.render_comment_created(comment),
+            "thread_id": comment.thread_id,
+            "sort_keys": self.root_sort_keys(comment)
+        }
+        groups = self.comment_groups(comment)
+        for group in groups:
+            await self.channel_layer.group_send(group, event)
+        metrics.observe_broadcast("comment_created", started, len(groups))
+
+    @classmethod
+    def comment_groups(cls, comment):
+        if comment.reply_id is None:
+            # A new root can land on the first page of any sort order.
+            return [
+                cls.page_group_name(cls.page_key(sort_by, sort_order))
+                for sort_by in cls.SORTING
+                for sort_order in ("asc", "desc")
+            ]
+        return [cls.thread_group_name(comment.root_id)]
+
+    @classmethod
+    def root_sort_keys(cls, comment):
+        return cls.comment_sort_keys(comment) if comment.reply_id is None else None
+
+    async def comment_created(self, event):
+        metrics.count_delivery("comment_created")
+        await self.deliver_comment(event["frames"], event["thread_id"], event.get("sort_keys"))
+
+    async def comments_created(self, event):
+        metrics.count_delivery("comments_created")
+        for created in event["comments"]:
+            await self.deliver_comment(created["frames"], created["thread_id"], created.get("sort_keys"))
+
+    def shows_new_root(self, sort_keys):
+        if self.page_last_key is None:
+            return True
+        sort_by, sort_order = self.page_key(self.current_sort_by, self.current_sort_order).split(":")
+        key = sort_keys[sort_by]
+        # New roots have the highest id, so they go first among equal keys
+        # when descending and last when ascending. str comparison is by code
+        # point, like the "C" collation the sort columns use.
+        return key >= self.page_last_key if sort_order == "desc" else key < self.page_last_key
+
+    async def deliver_comment(self, frames, thread_id, sort_keys=None):
+        thread_group = self.thread_group_name(thread_id)
+        if sort_keys is not None and thread_group not in self.thread_groups and self.shows_new_root(sort_keys):
+            # Follow replies to new roots shown on this socket's first page.
+            await self.channel_layer.group_add(thread_group, self.channel_name)
+            self.thread_groups.add(thread_group)
+        await self.send_frame(frames)
 
     async def broadcast_comments(self, event):
-        await self.send_comments_list(
-            page=1,
-            page_size=25,
-            sort_by=event.get("sort_by", "date"),
-            sort_order=event.get("sort_order", "desc")
-        )
+        metrics.count_delivery("broadcast_comments")
+        # Shared pages are rendered with the default reply limit; sockets
+        # that asked for another one re-render their own first page.
+        if self.replies_limit == settings.COMMENTS_REPLIES_LIMIT:
+            self.pending_page = event["page"]
+        else:
+            self.pending_page = None
+        if self.page_refresh is None:
+            self.page_refresh = Coalescer(settings.COMMENTS_BROADCAST_WINDOW, self.send_pending_page)
+        self.page_refresh.trigger()
+
+    async def send_pending_page(self):
+        if self.pending_page is None:
+            await self.send_comments_list(
+                page=1,
+                page_size=25,
+                sort_by=self.current_sort_by,
+                sort_order=self.current_sort_order
+            )
+        else:
+            await self.send_frame(self.pending_page, coalesce="list_comments")
+
+
+async def broadcast_first_pages(channel_layer):
+    started = time.perf_counter()
+    pages = await CommentConsumer().render_first_pages()
+    for page_key, page in pages.items():
+        await channel_layer.group_send(CommentConsumer.page_group_name(page_key), {
+            "type": "broadcast_comments",
+            "page": page
+        })
+    metrics.observe_broadcast("broadcast_comments", started, len(pages))
+
+
+def refresh_first_pages(channel_layer):
+    # Shared by every socket of the process, so it must not hold on to one.
+    group_coalescer(
+        "comments.pages", settings.COMMENTS_BROADCAST_WINDOW,
+        functools.partial(broadcast_first_pages, channel_layer)
+    ).trigger()
+
+
+@pooled_database_sync_to_async
+def save_comments(requests):
+    return CommentConsumer.create_comments_in_transaction(requests)
+
+
+@pooled_database_sync_to_async
+def render_comments_created(comments):
+    return [CommentConsumer.comment_created_frames(comment) for comment in comments]
+
+
+async def save_and_broadcast(channel_layer, requests):
+    results = await save_comments(requests)
+    comments = [comment for comment in results if isinstance(comment, Comment)]
+    if comments:
+        await broadcast_new_comments(channel_layer, comments)
+    return results
+
+
+async def broadcast_new_comments(channel_layer, comments):
+    if settings.COMMENTS_BROADCAST_MODE == "page":
+        refresh_first_pages(channel_layer)
+        return
+
+    started = time.perf_counter()
+    events = defaultdict(list)
+    for comment, frames in zip(comments, await render_comments_created(comments)):
+        for group in CommentConsumer.comment_groups(comment):
+            events[group].append({
+                "frames": frames, "thread_id": comment.thread_id, "sort_keys": CommentConsumer.root_sort_keys(comment)
+            })
+    for group, created in events.items():
+        await channel_layer.group_send(group, {"type": "comments_created", "comments": created})
+    metrics.observe_broadcast("comments_created", started, len(events))
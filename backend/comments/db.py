@@ -0,0 +1,98 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from channels.db import DatabaseSyncToAsync
+
+from comments import metrics
+
+
+# Execute wrappers applied to every connection a pooled call uses, on
+# whichever worker thread it runs (see QueryCounter in benchmark.py).
+query_observers = []
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_stats_lock = threading.Lock()
+executor_stats = {"calls": 0, "waited_ms": 0.0, "max_wait_ms": 0.0, "slow_waits": 0}
+
+
+def record_wait(wait_ms):
+    with _stats_lock:
+        executor_stats["calls"] += 1
+        executor_stats["waited_ms"] += wait_ms
+        executor_stats["max_wait_ms"] = max(executor_stats["max_wait_ms"], wait_ms)
+        if wait_ms >= settings.COMMENTS_DB_WAIT_WARN_MS:
+            executor_stats["slow_waits"] += 1
+    if wait_ms >= settings.COMMENTS_DB_WAIT_WARN_MS:
+        logger.warning("database call waited for a thread", extra={"wait_ms": round(wait_ms, 1)})
+
+
+class TimedThreadPoolExecutor(ThreadPoolExecutor):
+    def submit(self, fn, /, *args, **kwargs):
+        queued = time.perf_counter()
+        metrics.db_call_queued()
+
+        def run():
+            wait_ms = (time.perf_counter() - queued) * 1000
+            metrics.db_call_started(wait_ms)
+            record_wait(wait_ms)
+            return fn(*args, **kwargs)
+
+        return super().submit(run)
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        workers = settings.COMMENTS_DB_WORKERS
+        if any(connections[alias].vendor == "sqlite" for alias in connections):
+            # SQLite locks whole tables, so concurrent connections only fail.
+            workers = 1
+        _executor = TimedThreadPoolExecutor(max_workers=workers, thread_name_prefix="comments-db")
+    return _executor
+
+
+class PooledDatabaseSyncToAsync(DatabaseSyncToAsync):
+    """
+    DatabaseSyncToAsync on a pool of COMMENTS_DB_WORKERS threads.
+
+    Django connections are per thread, so each worker keeps its own and
+    queries from different sockets run concurrently instead of queueing
+    on the single thread-sensitive executor. A call must not rely on
+    state left in a connection by an earlier call.
+    """
+
+    def __init__(self, func):
+        super().__init__(func, thread_sensitive=False)
+
+    async def __call__(self, *args, **kwargs):
+        self._executor = get_executor()
+        return await super().__call__(*args, **kwargs)
+
+    def thread_handler(self, loop, *args, **kwargs):
+        with ExitStack() as stack:
+            for observer in list(query_observers):
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(observer))
+            return super().thread_handler(loop, *args, **kwargs)
+
+
+pooled_database_sync_to_async = PooledDatabaseSyncToAsync
+
+
+def db_stats():
+    """Thread wait totals for pooled calls, plus psycopg pool stats per alias in "pool" mode."""
+    with _stats_lock:
+        stats = {"executor": dict(executor_stats), "pools": {}}
+    for alias in connections:
+        pool = getattr(connections[alias], "pool", None)
+        if pool is not None:
+            stats["pools"][alias] = pool.get_stats()
+    return stats
@@ -0,0 +1,42 @@
+import msgpack
+import orjson
+
+
+class JsonEncoding:
+    name = "json"
+    subprotocol = None
+
+    @staticmethod
+    def encode(payload):
+        return orjson.dumps(payload).decode()
+
+    @staticmethod
+    def frame(data):
+        return {"text_data": data}
+
+
+class MsgpackEncoding:
+    name = "msgpack"
+    subprotocol = "comments.msgpack"
+
+    @staticmethod
+    def encode(payload):
+        return msgpack.packb(payload)
+
+    @staticmethod
+    def frame(data):
+        return {"bytes_data": data}
+
+
+ENCODINGS = (JsonEncoding, MsgpackEncoding)
+
+
+def negotiate(subprotocols):
+    for encoding in ENCODINGS:
+        if encoding.subprotocol in subprotocols:
+            return encoding
+    return JsonEncoding
+
+
+def encode_all(payload):
+    return {encoding.name: encoding.encode(payload) for encoding in ENCODINGS}
@@ -0,0 +1,35 @@
+import json
+import struct
+
+from django.conf import settings
+
+from rest_framework.exceptions import ValidationError
+
+
+# Binary upload frame: a 4-byte big-endian header length, a UTF-8 JSON
+# header with the comment fields, then the raw image bytes.
+HEADER_LENGTH = struct.Struct("!I")
+
+
+def parse_upload_frame(frame):
+    if len(frame) > settings.COMMENTS_IMAGE_MAX_BYTES + settings.COMMENTS_UPLOAD_HEADER_MAX_BYTES:
+        raise ValidationError("Image is too large.")
+    view = memoryview(frame)
+    if len(view) < HEADER_LENGTH.size:
+        raise ValidationError("Invalid upload frame.")
+    (header_length,) = HEADER_LENGTH.unpack_from(view)
+    image_offset = HEADER_LENGTH.size + header_length
+    if header_length > settings.COMMENTS_UPLOAD_HEADER_MAX_BYTES or image_offset > len(view):
+        raise ValidationError("Invalid upload frame.")
+    try:
+        header = json.loads(bytes(view[HEADER_LENGTH.size:image_offset]))
+    except ValueError:
+        raise ValidationError("Invalid upload frame.")
+    if not isinstance(header, dict):
+        raise ValidationError("Invalid upload frame.")
+    return header, image_offset
+
+
+def build_upload_frame(header, image):
+    header = json.dumps(header).encode()
+    return HEADER_LENGTH.pack(len(header)) + header + image
@@ -0,0 +1,153 @@
+import asyncio
+import base64
+import binascii
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+from PIL import Image
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+
+from rest_framework.exceptions import ValidationError
+
+
+ALLOWED_FORMATS = ("JPEG", "PNG", "GIF")
+THUMBNAIL_SIZE = (320, 240)
+# Extra boxes for srcset, besides THUMBNAIL_SIZE; variants are keyed by box width.
+VARIANT_SIZES = ((160, 120), (640, 480))
+IMAGE_DIR = "chat/images"
+
+_executor = None
+_pending = 0
+
+
+class ImageUpload(ContentFile):
+    """Thumbnail of an upload named by the upload's SHA-256, with its srcset variants."""
+
+    def __init__(self, content, name, variants, srcset):
+        super().__init__(content, name=name)
+        self.variants = variants
+        self.srcset = srcset
+
+
+def open_image(data):
+    try:
+        img = Image.open(BytesIO(data))
+        if img.format not in ALLOWED_FORMATS:
+            raise ValueError("Invalid image type. Allowed types: JPG, PNG, GIF.")
+        img.load()
+    except (OSError, Image.DecompressionBombError):
+        raise ValueError("Invalid file. Please upload a valid image.")
+    return img
+
+
+def resize(img, size, img_format):
+    if img.width > size[0] or img.height > size[1]:
+        img = img.copy()
+        img.thumbnail(size, Image.Resampling.LANCZOS)
+    buffer = BytesIO()
+    img.save(buffer, format=img_format)
+    return buffer.getvalue(), img.width
+
+
+def thumbnail(data):
+    img = open_image(data)
+    content, _ = resize(img, THUMBNAIL_SIZE, img.format)
+    return content, img.format.lower()
+
+
+def render_variants(data):
+    """
+    Thumbnail plus every srcset variant in the upload's format and WebP.
+
+    Names derive from the SHA-256 of the upload, so the same image uploaded
+    twice maps to the same files, and a variant that would come out as
+    wide as a smaller one is left out.
+    """
+    img = open_image(data)
+    ext = img.format.lower()
+    digest = hashlib.sha256(data).hexdigest()
+    base = f"{IMAGE_DIR}/{digest[:2]}/{digest}"
+    variants = {}
+    srcset = {"image": [], "webp": []}
+    for size in sorted(VARIANT_SIZES + (THUMBNAIL_SIZE,)):
+        suffix = "" if size == THUMBNAIL_SIZE else f"_{size[0]}"
+        for key, img_format, name in (
+            ("image", img.format, f"{base}{suffix}.{ext}"),
+            ("webp", "WEBP", f"{base}{suffix}.webp"),
+        ):
+            content, width = resize(img, size, img_format)
+            if size == THUMBNAIL_SIZE and key == "image":
+                thumbnail_content = content
+            if srcset[key] and srcset[key][-1][1] == width:
+                continue
+            if name != f"{base}.{ext}":
+                variants[name] = content
+            srcset[key].append([name, width])
+    return thumbnail_content, f"{base}.{ext}", variants, srcset
+
+
+def render_base64_variants(image_base64):
+    try:
+        _, data = image_base64.split(";base64,")
+        data = base64.b64decode(data, validate=True)
+    except (ValueError, binascii.Error):
+        raise ValueError("Invalid image data.")
+    return render_variants(data)
+
+
+def render_frame_variants(frame, offset):
+    return render_variants(memoryview(frame)[offset:])
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=settings.COMMENTS_IMAGE_WORKERS)
+    return _executor
+
+
+def check_size(size):
+    if size > settings.COMMENTS_IMAGE_MAX_BYTES:
+        raise ValidationError("Image is too large.")
+
+
+async def run_in_pool(func, *args):
+    global _pending
+    if _pending >= settings.COMMENTS_IMAGE_QUEUE_SIZE:
+        raise ValidationError("Too many images are being processed, try again later.")
+    _pending += 1
+    try:
+        result = await asyncio.get_running_loop().run_in_executor(get_executor(), func, *args)
+    except ValueError as e:
+        raise ValidationError(str(e))
+    finally:
+        _pending -= 1
+    return ImageUpload(*result)
+
+
+def store_image(upload, storage):
+    """Write the files of an ImageUpload that are not stored yet and return its name."""
+    for name, content in ((upload.name, upload), *upload.variants.items()):
+        if not storage.exists(name):
+            storage.save(name, content if name == upload.name else ContentFile(content))
+    return upload.name
+
+
+async def process_base64_image(image_base64):
+    if not isinstance(image_base64, str):
+        raise ValidationError("Invalid image data.")
+    check_size(len(image_base64) * 3 // 4)
+    return await run_in_pool(render_base64_variants, image_base64)
+
+
+async def process_image(data):
+    check_size(len(data))
+    return await run_in_pool(render_variants, data)
+
+
+async def process_image_frame(frame, offset):
+    check_size(len(frame) - offset)
+    return await run_in_pool(render_frame_variants, frame, offset)
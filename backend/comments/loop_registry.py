@@ -0,0 +1,23 @@
+import asyncio
+import weakref
+
+
+_instances = weakref.WeakKeyDictionary()
+
+
+def per_loop(cls, name, **attrs):
+    """
+    Return the ``cls`` instance called ``name`` for the running event loop,
+    creating it as ``cls(**attrs)`` the first time.
+
+    Later calls set ``attrs`` on the existing instance, so the latest
+    settings and callbacks take effect.
+    """
+    instances = _instances.setdefault(asyncio.get_running_loop(), {})
+    instance = instances.get((cls, name))
+    if instance is None:
+        instance = instances[(cls, name)] = cls(**attrs)
+    else:
+        for attr, value in attrs.items():
+            setattr(instance, attr, value)
+    return instance
@@ -0,0 +1,91 @@
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test.utils import (
+    override_settings,
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+    teardown_test_environment,
+)
+
+from comments.benchmark import run_benchmark, run_multiprocess_benchmark
+
+
+class Command(BaseCommand):
+    help = "Benchmark the comments WebSocket against a throwaway test database."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sockets", type=int, default=10)
+        parser.add_argument("--messages", type=int, default=20, help="Messages sent per socket.")
+        parser.add_argument("--create-ratio", type=float, default=0.2)
+        parser.add_argument("--page-size", type=int, default=25)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--keepdb", action="store_true")
+        parser.add_argument(
+            "--throttle", action="store_true", help="Keep the WebSocket rate limits enabled."
+        )
+        parser.add_argument("--json", action="store_true", help="Print the raw results as JSON.")
+        parser.add_argument(
+            "--workers", type=int, default=1, help="Number of forked ASGI worker processes."
+        )
+        parser.add_argument(
+            "--channel-layer", choices=("memory", "settings"), default="memory",
+            help="Use an in-process layer, or the configured (Redis) layer shared by all workers."
+        )
+
+    def handle(self, *args, **options):
+        from comments_service.asgi import application
+
+        workers = options["workers"]
+        database = settings.DATABASES["default"]
+        test_dir = None
+        if workers > 1 and database["ENGINE"].endswith("sqlite3") and not database["TEST"].get("NAME"):
+            # An in-memory SQLite test database cannot be shared with forked workers.
+            test_dir = tempfile.mkdtemp()
+            database["TEST"]["NAME"] = os.path.join(test_dir, "bench.sqlite3")
+
+        setup_test_environment(debug=False)
+        old_config = setup_databases(verbosity=0, interactive=False, keepdb=options["keepdb"])
+        overrides = {}
+        if options["channel_layer"] == "memory":
+            overrides["CHANNEL_LAYERS"] = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+        if not options["throttle"]:
+            overrides.update(COMMENTS_CONNECTION_THROTTLE_RATES={}, COMMENTS_USER_THROTTLE_RATES={})
+        benchmark = {
+            "sockets": options["sockets"],
+            "messages": options["messages"],
+            "create_ratio": options["create_ratio"],
+            "page_size": options["page_size"],
+            "seed": options["seed"],
+        }
+        try:
+            with override_settings(**overrides):
+                if workers > 1:
+                    results = run_multiprocess_benchmark(application, workers, **benchmark)
+                else:
+                    results = asyncio.run(run_benchmark(application, **benchmark))
+        finally:
+            teardown_databases(old_config, verbosity=0, keepdb=options["keepdb"])
+            teardown_test_environment()
+            if test_dir is not None:
+                shutil.rmtree(test_dir, ignore_errors=True)
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(
+            f"{results['workers']} workers, {results['sockets']} sockets, {results['messages_received']} frames received "
+            f"in {results['elapsed_s']:.2f}s ({results['messages_per_s']:.0f} msg/s), "
+            f"peak RSS {results['peak_rss_mb']:.0f} MB"
+        )
+        for action, stats in results["actions"].items():
+            self.stdout.write(
+                f"{action:>15}: n={stats['count']:<5} p50={stats['p50_ms']:.1f}ms "
+                f"p95={stats['p95_ms']:.1f}ms p99={stats['p99_ms']:.1f}ms queries={stats['queries']}"
+            )
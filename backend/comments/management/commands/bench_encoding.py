@@ -0,0 +1,61 @@
+import json
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.test.utils import (
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+    teardown_test_environment,
+)
+
+from comments.benchmark import compare_encodings
+from comments.models import Comment
+from comments.tree import load_reply_trees
+
+
+class Command(BaseCommand):
+    help = "Compare the DRF and plain-dict serialization paths for one page of comments."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--page-size", type=int, default=25)
+        parser.add_argument("--replies", type=int, default=4, help="Replies per root comment.")
+        parser.add_argument("--depth", type=int, default=2, help="Nesting depth of each reply chain.")
+        parser.add_argument("--rounds", type=int, default=200)
+        parser.add_argument("--json", action="store_true", help="Print the raw results as JSON.")
+
+    def handle(self, *args, **options):
+        setup_test_environment(debug=False)
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            self.create_page(options["page_size"], options["replies"], options["depth"])
+            roots = Comment.objects.filter(reply=None).order_by("-created_at", "-pk")
+            comments = load_reply_trees(list(roots[:options["page_size"]]))
+            results = compare_encodings(comments, options["rounds"])
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        baseline = results["drf+json"]["us_per_page"]
+        for name, stats in results.items():
+            self.stdout.write(
+                f"{name:>13}: {stats['us_per_page']:8.0f}us/page {stats['bytes']:7} bytes "
+                f"({baseline / stats['us_per_page']:.1f}x)"
+            )
+
+    @staticmethod
+    def create_page(page_size, replies, depth):
+        user = get_user_model().objects.create_user(
+            username="encoder", email="encoder@example.com", password="Password1"
+        )
+        for index in range(page_size):
+            root = Comment.objects.create(user=user, text=f"root {index} " * 8)
+            for reply_index in range(replies):
+                parent = root
+                for level in range(depth):
+                    parent = Comment.objects.create(
+                        user=user, text=f"reply {reply_index}.{level} " * 4, reply=parent
+                    )
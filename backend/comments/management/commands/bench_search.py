@@ -0,0 +1,62 @@
+import json
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+    teardown_test_environment,
+)
+
+from comments.benchmark import measure_search
+from comments.models import Comment
+from comments.synthetic import load_comments, load_users, vocabulary
+
+
+class Command(BaseCommand):
+    help = "Benchmark full-text comment search on a throwaway PostgreSQL test database."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--comments", type=int, default=2_000_000)
+        parser.add_argument("--queries", type=int, default=200)
+        parser.add_argument("--page-size", type=int, default=25)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--keepdb", action="store_true", help="Keep the test database and reuse its comments."
+        )
+        parser.add_argument("--json", action="store_true", help="Print the raw results as JSON.")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("Full-text search needs PostgreSQL; other databases use a substring scan.")
+
+        setup_test_environment(debug=False)
+        old_config = setup_databases(verbosity=0, interactive=False, keepdb=options["keepdb"])
+        try:
+            missing = options["comments"] - Comment.objects.count()
+            if missing > 0:
+                self.stdout.write(f"Creating {missing} comments...")
+                author_ids = list(
+                    get_user_model().objects.filter(username__startswith="synthetic").order_by("pk").values_list("pk", flat=True)
+                )
+                if not author_ids:
+                    *_, (_, author_ids) = load_users(100)
+                for _ in load_comments(missing, author_ids, seed=options["seed"]):
+                    pass
+                with connection.cursor() as cursor:
+                    cursor.execute(f"ANALYZE {Comment._meta.db_table}")
+            results = measure_search(vocabulary(), options["queries"], options["page_size"], options["seed"])
+            results["comments"] = Comment.objects.count()
+        finally:
+            teardown_databases(old_config, verbosity=0, keepdb=options["keepdb"])
+            teardown_test_environment()
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(
+            f"{results['queries']} searches over {results['comments']} comments: "
+            f"p50={results['p50_ms']:.1f}ms p95={results['p95_ms']:.1f}ms p99={results['p99_ms']:.1f}ms"
+        )
@@ -0,0 +1,52 @@
+import asyncio
+import json
+
+from django.core.management.base import BaseCommand
+from django.test.utils import (
+    override_settings,
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+    teardown_test_environment,
+)
+
+from comments.benchmark import measure_writes
+
+
+class Command(BaseCommand):
+    help = "Compare comment inserts/s of the per-message and the buffered write path on a throwaway test database."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--comments", type=int, default=2000)
+        parser.add_argument("--senders", type=int, default=50, help="Concurrent writers, like sockets.")
+        parser.add_argument("--window", type=float, default=0.005, help="Buffer window in seconds.")
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument("--reply-ratio", type=float, default=0.5)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--json", action="store_true", help="Print the raw results as JSON.")
+
+    def handle(self, *args, **options):
+        setup_test_environment(debug=False)
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            with override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}):
+                results = asyncio.run(measure_writes(
+                    options["comments"],
+                    options["senders"],
+                    options["window"],
+                    options["batch_size"],
+                    options["reply_ratio"],
+                    options["seed"],
+                ))
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for mode, stats in results.items():
+            self.stdout.write(
+                f"{mode:>8}: {stats['comments_per_s']:.0f} comments/s, {stats['queries_per_comment']:.2f} queries/comment, "
+                f"p50={stats['p50_ms']:.1f}ms p99={stats['p99_ms']:.1f}ms"
+            )
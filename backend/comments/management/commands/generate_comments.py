@@ -0,0 +1,52 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from comments.models import Comment
+from comments.synthetic import load_comments, load_users
+
+
+class Command(BaseCommand):
+    help = "Bulk load synthetic users and comment threads into the configured database for profiling."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100_000)
+        parser.add_argument("--comments", type=int, default=1_000_000)
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--days", type=int, default=365, help="Spread root comments over this many days.")
+        parser.add_argument("--fanout", type=float, default=0.6, help="Mean replies of a typical root.")
+        parser.add_argument("--max-depth", type=int, default=8)
+        parser.add_argument("--max-thread-size", type=int, default=5000)
+        parser.add_argument(
+            "--prefix", default="synthetic", help="Username prefix; must not clash with existing users."
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        author_ids = []
+        for total, author_ids in load_users(options["users"], options["prefix"], options["batch_size"]):
+            self.report("users", total, started)
+
+        started = time.perf_counter()
+        for total in load_comments(
+            options["comments"],
+            author_ids,
+            prefix=options["prefix"],
+            batch_size=options["batch_size"],
+            seed=options["seed"],
+            days=options["days"],
+            fanout=options["fanout"],
+            max_depth=options["max_depth"],
+            max_thread_size=options["max_thread_size"],
+        ):
+            self.report("comments", total, started)
+
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute(f"ANALYZE {Comment._meta.db_table}")
+
+    def report(self, label, total, started):
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f"{label}: {total} rows in {elapsed:.1f}s ({total / elapsed if elapsed else 0:.0f} rows/s)")
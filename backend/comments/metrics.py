@@ -0,0 +1,168 @@
+import os
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client.multiprocess import MultiProcessCollector
+
+
+# Every helper below returns at once unless enable() was called (see
+# COMMENTS_METRICS_ENABLED), so a disabled server only pays a flag check.
+enabled = False
+
+# Queries of the message being handled: [count, seconds]. Pooled database
+# calls run in a copy of the caller's context, so the observer sees it.
+_message_queries = ContextVar("message_queries", default=None)
+_disabled = nullcontext()
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+message_seconds = Histogram(
+    "comments_ws_message_seconds", "Time to handle one WebSocket message.", ["action"], buckets=LATENCY_BUCKETS
+)
+message_queries = Histogram(
+    "comments_ws_message_queries", "Database queries run for one WebSocket message.", ["action"],
+    buckets=COUNT_BUCKETS
+)
+message_query_seconds = Histogram(
+    "comments_ws_message_query_seconds", "Database time spent on one WebSocket message.", ["action"],
+    buckets=LATENCY_BUCKETS
+)
+handshake_seconds = Histogram(
+    "comments_ws_handshake_seconds", "Token authentication time of a WebSocket handshake.", ["outcome"],
+    buckets=LATENCY_BUCKETS
+)
+connections = Gauge(
+    "comments_ws_connections", "Open authenticated WebSocket connections.", multiprocess_mode="livesum"
+)
+outbound_bytes = Counter("comments_ws_outbound_bytes", "Bytes written to WebSockets.", ["frame"])
+broadcast_seconds = Histogram(
+    "comments_broadcast_seconds", "Time to render and publish one broadcast.", ["type"], buckets=LATENCY_BUCKETS
+)
+broadcast_groups = Histogram(
+    "comments_broadcast_groups", "Channel groups one broadcast is published to.", ["type"], buckets=COUNT_BUCKETS
+)
+broadcast_deliveries = Counter(
+    "comments_broadcast_deliveries", "Broadcast events received by sockets; divide by broadcasts for fan-out.",
+    ["type"]
+)
+db_queue_depth = Gauge(
+    "comments_db_queue_depth", "Database calls waiting for a pool thread.", multiprocess_mode="livesum"
+)
+db_wait_seconds = Histogram(
+    "comments_db_wait_seconds", "Time a database call waited for a pool thread.", buckets=LATENCY_BUCKETS
+)
+
+
+def observe_query(execute, sql, params, many, context):
+    stats = _message_queries.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats[0] += 1
+        stats[1] += time.perf_counter() - started
+
+
+def enable():
+    global enabled
+    from comments.db import query_observers
+
+    enabled = True
+    if observe_query not in query_observers:
+        query_observers.append(observe_query)
+
+
+def disable():
+    global enabled
+    from comments.db import query_observers
+
+    enabled = False
+    if observe_query in query_observers:
+        query_observers.remove(observe_query)
+
+
+@contextmanager
+def _observe_message(action):
+    stats = [0, 0.0]
+    token = _message_queries.set(stats)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _message_queries.reset(token)
+        message_seconds.labels(action).observe(time.perf_counter() - started)
+        message_queries.labels(action).observe(stats[0])
+        message_query_seconds.labels(action).observe(stats[1])
+
+
+def observe_message(action):
+    return _observe_message(action) if enabled else _disabled
+
+
+def observe_handshake(started, authenticated):
+    if enabled:
+        outcome = "authenticated" if authenticated else "anonymous"
+        handshake_seconds.labels(outcome).observe(time.perf_counter() - started)
+
+
+def connection_opened():
+    if enabled:
+        connections.inc()
+
+
+def connection_closed():
+    if enabled:
+        connections.dec()
+
+
+def count_outbound(text_data, bytes_data):
+    if enabled:
+        if text_data is not None:
+            outbound_bytes.labels("text").inc(len(text_data.encode()))
+        if bytes_data is not None:
+            outbound_bytes.labels("binary").inc(len(bytes_data))
+
+
+def observe_broadcast(event_type, started, groups):
+    if enabled:
+        broadcast_seconds.labels(event_type).observe(time.perf_counter() - started)
+        broadcast_groups.labels(event_type).observe(groups)
+
+
+def count_delivery(event_type):
+    if enabled:
+        broadcast_deliveries.labels(event_type).inc()
+
+
+def db_call_queued():
+    if enabled:
+        db_queue_depth.inc()
+
+
+def db_call_started(wait_ms):
+    if enabled:
+        db_queue_depth.dec()
+        db_wait_seconds.observe(wait_ms / 1000)
+
+
+def render():
+    """Exposition text for all processes sharing PROMETHEUS_MULTIPROC_DIR, or this one."""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,55 @@
+# Generated by Django 5.1.1 on 2026-10-18 15:47
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def copy_author_fields(apps, schema_editor):
+    Comment = apps.get_model('comments', 'Comment')
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    author = User.objects.filter(pk=OuterRef('user_id'))
+    Comment.objects.update(
+        author_username=Subquery(author.values('username')[:1]),
+        author_email=Subquery(author.values('email')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comments', '0005_comment_image'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='author_email',
+            field=models.EmailField(blank=True, editable=False, max_length=254),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='author_username',
+            field=models.CharField(blank=True, editable=False, max_length=24),
+        ),
+        migrations.RunPython(copy_author_fields, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['reply', 'created_at', 'id'], name='comment_reply_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['reply', 'author_username', 'id'], name='comment_reply_username_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['reply', 'author_email', 'id'], name='comment_reply_email_idx'),
+        ),
+        migrations.AlterField(
+            model_name='comment',
+            name='reply',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='replies', to='comments.comment'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.1 on 2026-10-18 15:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_roots(apps, schema_editor):
+    Comment = apps.get_model('comments', 'Comment')
+    roots = {}
+    pending = []
+    # Parents are always created before their replies, so walking by id
+    # sees every parent's root before its children.
+    for pk, reply_id in Comment.objects.order_by('id').values_list('id', 'reply_id').iterator():
+        if reply_id is None:
+            continue
+        roots[pk] = roots.get(reply_id, reply_id)
+        pending.append(Comment(pk=pk, root_id=roots[pk]))
+        if len(pending) >= 1000:
+            Comment.objects.bulk_update(pending, ['root'])
+            pending = []
+    Comment.objects.bulk_update(pending, ['root'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comments', '0006_comment_author_fields_and_sort_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='root',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='thread_replies', to='comments.comment'),
+        ),
+        migrations.RunPython(fill_roots, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.1.1 on 2026-10-18 16:12
+
+from django.db import migrations, models
+from django.db.models import Count, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_replies(apps, schema_editor):
+    Comment = apps.get_model('comments', 'Comment')
+    replies = Comment.objects.filter(reply_id=OuterRef('pk')).order_by().values('reply_id')
+    Comment.objects.update(
+        reply_count=Coalesce(Subquery(replies.annotate(count=Count('id')).values('count')[:1]), 0),
+        last_reply_at=Subquery(replies.annotate(last=Max('created_at')).values('last')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comments', '0007_comment_root'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='last_reply_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='reply_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_replies, migrations.RunPython.noop),
+    ]
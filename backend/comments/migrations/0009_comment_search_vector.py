@@ -0,0 +1,52 @@
+# Generated by Django 5.1.1 on 2026-10-18 16:14
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations, models
+
+
+def add_search_vector(apps, schema_editor):
+    table = schema_editor.quote_name(apps.get_model('comments', 'Comment')._meta.db_table)
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            f"ALTER TABLE {table} ADD COLUMN search_vector tsvector "
+            f"GENERATED ALWAYS AS (to_tsvector('simple'::regconfig, COALESCE(text, ''))) STORED"
+        )
+        schema_editor.execute(f"CREATE INDEX comment_search_idx ON {table} USING gin (search_vector)")
+    else:
+        # Generated tsvector columns only exist on PostgreSQL; elsewhere the
+        # column just has to be selectable.
+        schema_editor.execute(f"ALTER TABLE {table} ADD COLUMN search_vector text NULL")
+
+
+def remove_search_vector(apps, schema_editor):
+    table = schema_editor.quote_name(apps.get_model('comments', 'Comment')._meta.db_table)
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute("DROP INDEX IF EXISTS comment_search_idx")
+    schema_editor.execute(f"ALTER TABLE {table} DROP COLUMN search_vector")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comments', '0008_comment_reply_count'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddField(
+                    model_name='comment',
+                    name='search_vector',
+                    field=models.GeneratedField(db_persist=True, expression=django.contrib.postgres.search.SearchVector('text', config='simple'), output_field=django.contrib.postgres.search.SearchVectorField()),
+                ),
+                migrations.AddIndex(
+                    model_name='comment',
+                    index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='comment_search_idx'),
+                ),
+            ],
+            database_operations=[
+                migrations.RunPython(add_search_vector, remove_search_vector),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-18 16:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comments', '0009_comment_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='image_srcset',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+    ]
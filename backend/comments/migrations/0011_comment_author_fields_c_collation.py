@@ -0,0 +1,30 @@
+from django.db import migrations
+
+
+COLUMNS = (('author_username', 'varchar(24)'), ('author_email', 'varchar(254)'))
+
+
+def set_collation(collation):
+    def alter(apps, schema_editor):
+        # SQLite already compares text by code point. PostgreSQL rebuilds the
+        # sort indexes from migration 0006 with the new collation.
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        table = schema_editor.quote_name(apps.get_model('comments', 'Comment')._meta.db_table)
+        for column, column_type in COLUMNS:
+            schema_editor.execute(
+                f'ALTER TABLE {table} ALTER COLUMN {schema_editor.quote_name(column)} '
+                f'TYPE {column_type} COLLATE "{collation}"'
+            )
+    return alter
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comments', '0010_comment_image_srcset'),
+    ]
+
+    operations = [
+        migrations.RunPython(set_collation('C'), set_collation('default')),
+    ]
@@ -1,20 +1,79 @@
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from django.db import models
 from django.conf import settings
 
 from comments.utils import image_file
 
 
+class CommentManager(models.Manager):
+    def get_queryset(self):
+        # The tsvector is only used by search filters, never read back.
+        return super().get_queryset().defer("search_vector")
+
+
 class Comment(models.Model):
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
         related_name="comments"
     )
-    reply = models.ForeignKey("self", on_delete=models.CASCADE, null=True, blank=True, related_name="replies")
+    reply = models.ForeignKey(
+        "self",
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name="replies",
+        db_index=False
+    )
+    root = models.ForeignKey(
+        "self",
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name="thread_replies",
+        editable=False
+    )
     home_page = models.URLField(blank=True, null=True)
     text = models.CharField(max_length=2084)
     image = models.ImageField(upload_to=image_file, blank=True, null=True)
+    # [[name, width], ...] per format for images stored by comments.images.store_image.
+    image_srcset = models.JSONField(blank=True, null=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Sorted and compared by code point (COLLATE "C" on PostgreSQL, see
+    # migration 0011), the same order Python and the client compare sort keys in.
+    author_username = models.CharField(max_length=24, blank=True, editable=False)
+    author_email = models.EmailField(blank=True, editable=False)
+    reply_count = models.PositiveIntegerField(default=0, editable=False)
+    last_reply_at = models.DateTimeField(blank=True, null=True, editable=False)
+    # Stored by PostgreSQL on every write; always NULL on other databases
+    # (see migration 0009), where search falls back to a substring match.
+    search_vector = models.GeneratedField(
+        expression=SearchVector("text", config="simple"),
+        output_field=SearchVectorField(),
+        db_persist=True
+    )
+
+    objects = CommentManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["reply", "created_at", "id"], name="comment_reply_created_idx"),
+            models.Index(fields=["reply", "author_username", "id"], name="comment_reply_username_idx"),
+            models.Index(fields=["reply", "author_email", "id"], name="comment_reply_email_idx"),
+            GinIndex(fields=["search_vector"], name="comment_search_idx"),
+        ]
 
     def __str__(self):
         return f"{self.user} - {self.text}"
+
+    @property
+    def thread_id(self):
+        return self.root_id or self.id
+
+    def save(self, *args, **kwargs):
+        self.author_username = self.user.username
+        self.author_email = self.user.email
+        if self.reply_id and not self.root_id:
+            self.root_id = self.reply.thread_id
+        super().save(*args, **kwargs)
@@ -0,0 +1,32 @@
+import asyncio
+from collections import deque
+
+
+class OutboxFull(Exception):
+    pass
+
+
+class Outbox:
+    def __init__(self, send, max_size):
+        self.send = send
+        self.max_size = max_size
+        self.items = deque()
+        self.ready = asyncio.Event()
+
+    def push(self, text_data=None, bytes_data=None, coalesce=None):
+        if coalesce is not None:
+            # A newer page replaces any page of the same kind the client
+            # has not been sent yet.
+            self.items = deque(item for item in self.items if item[2] != coalesce)
+        if len(self.items) >= self.max_size:
+            raise OutboxFull()
+        self.items.append((text_data, bytes_data, coalesce))
+        self.ready.set()
+
+    async def run(self):
+        while True:
+            await self.ready.wait()
+            while self.items:
+                text_data, bytes_data, _ = self.items.popleft()
+                await self.send(text_data=text_data, bytes_data=bytes_data)
+            self.ready.clear()
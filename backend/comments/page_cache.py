@@ -0,0 +1,51 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from comments.sequence import current_version
+
+
+def page_cache_key(version, sort_key, page, page_size, encoding):
+    epoch, seq = version
+    return f"comments:page:{epoch}:{seq}:{sort_key}:{page}:{page_size}:{encoding}"
+
+
+def thread_cache_key(epoch, seq, thread_id, replies_limit):
+    return f"comments:thread:public:{epoch}:{seq}:{thread_id}:{replies_limit}"
+
+
+def cached_page(sort_key, page, page_size, render, encodings, version=None):
+    """Return ({encoding name: frame}, page info) for one page.
+
+    ``render(version)`` builds (payload dict, page info); it runs once on a
+    miss and the payload is then encoded for every requested encoding that
+    was not cached yet.
+    ``version`` is an (epoch, sequence) pair; pass it to read the page of a
+    version the caller already holds.
+    """
+    if version is None:
+        version = current_version()
+    keys = {
+        page_cache_key(version, sort_key, page, page_size, encoding.name): encoding
+        for encoding in encodings
+    }
+    entries = cache.get_many(keys)
+    missing = {key: encoding for key, encoding in keys.items() if key not in entries}
+    if missing:
+        payload, info = render(version)
+        fresh = {key: (encoding.encode(payload), info) for key, encoding in missing.items()}
+        cache.set_many(fresh, settings.COMMENTS_PAGE_CACHE_TIMEOUT)
+        entries.update(fresh)
+
+    frames = {keys[key].name: frame for key, (frame, _) in entries.items()}
+    info = next(iter(entries.values()))[1]
+    return frames, info
+
+
+def cached_thread(thread_id, epoch, seq, replies_limit, render):
+    """JSON body of one thread at topic sequence ``seq``; ``render()`` runs on a miss."""
+    key = thread_cache_key(epoch, seq, thread_id, replies_limit)
+    body = cache.get(key)
+    if body is None:
+        body = render()
+        cache.set(key, body, settings.COMMENTS_PAGE_CACHE_TIMEOUT)
+    return body
@@ -0,0 +1,117 @@
+import base64
+import binascii
+import json
+import math
+from datetime import datetime
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+
+from rest_framework.exceptions import ValidationError
+
+from comments.models import Comment
+
+
+ROOT_COUNT_KEY = "comments:root_count"
+ROOT_COUNT_TIMEOUT = 60
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(value, pk, direction):
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([value, pk, direction]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(token, field=None):
+    """(value, pk, direction) of a cursor; ``value`` is converted for ``field`` when given."""
+    try:
+        value, pk, direction = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except (AttributeError, ValueError, TypeError, binascii.Error):
+        raise ValidationError("Invalid cursor.")
+    if direction not in ("next", "prev") or not isinstance(pk, int) or isinstance(pk, bool):
+        raise ValidationError("Invalid cursor.")
+    if field is not None:
+        if value is None or isinstance(value, (bool, list, dict)):
+            raise ValidationError("Invalid cursor.")
+        try:
+            value = field.to_python(value)
+        except (DjangoValidationError, TypeError, ValueError):
+            raise ValidationError("Invalid cursor.")
+    return value, pk, direction
+
+
+def sort_field_of(queryset, sort_field):
+    if sort_field in queryset.query.annotations:
+        return queryset.query.annotations[sort_field].output_field
+    return queryset.model._meta.get_field(sort_field)
+
+
+def sort_value(obj, field):
+    for attr in field.split("__"):
+        obj = getattr(obj, attr)
+    return obj
+
+
+def keyset_paginate(queryset, sort_field, descending, page_size, cursor=None):
+    if cursor:
+        value, pk, direction = decode_cursor(cursor, sort_field_of(queryset, sort_field))
+    else:
+        value, pk, direction = None, None, "next"
+    backwards = direction == "prev"
+    # Walking backwards flips the comparison and the ordering, the page is
+    # reversed again below so it always comes out in the requested order.
+    reverse = descending != backwards
+    lookup = "lt" if reverse else "gt"
+    prefix = "-" if reverse else ""
+
+    if cursor:
+        queryset = queryset.filter(
+            Q(**{f"{sort_field}__{lookup}": value})
+            | Q(**{sort_field: value, f"pk__{lookup}": pk})
+        )
+    items = list(queryset.order_by(f"{prefix}{sort_field}", f"{prefix}pk")[:page_size + 1])
+    has_more = len(items) > page_size
+    items = items[:page_size]
+    if backwards:
+        items.reverse()
+
+    next_cursor = prev_cursor = None
+    if items:
+        first, last = items[0], items[-1]
+        if (has_more and not backwards) or (backwards and cursor):
+            next_cursor = encode_cursor(sort_value(last, sort_field), last.pk, "next")
+        if (has_more and backwards) or (cursor and not backwards):
+            prev_cursor = encode_cursor(sort_value(first, sort_field), first.pk, "prev")
+    return items, next_cursor, prev_cursor
+
+
+def parse_replies_limit(value):
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+        raise ValidationError("Invalid replies_limit.")
+    return value
+
+
+def parse_page_size(value, default=25):
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        raise ValidationError("Invalid page_size.")
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ValidationError("Invalid page_size.")
+    return min(max(value, 1), MAX_PAGE_SIZE)
+
+
+def approximate_count_pages(page_size):
+    count = cache.get_or_set(
+        ROOT_COUNT_KEY,
+        lambda: Comment.objects.filter(reply=None).count(),
+        ROOT_COUNT_TIMEOUT
+    )
+    return max(math.ceil(count / page_size), 1)
@@ -0,0 +1,55 @@
+import functools
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+from comments.sequence import written_within
+
+
+# Reads only go to DATABASE_REPLICAS inside replica_reads(); everything
+# else, writes and the reads that must see them included, uses the primary.
+_replica_reads = ContextVar("replica_reads", default=False)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _replica_reads.get() and settings.DATABASE_REPLICAS:
+            return random.choice(settings.DATABASE_REPLICAS)
+        return "default"
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in settings.DATABASE_REPLICAS
+
+
+@contextmanager
+def replica_reads():
+    """
+    Route the reads inside the block to a replica.
+
+    For DB_REPLICA_LAG seconds after any comment is written, reads stay on
+    the primary: pages rendered now are cached under the new version for
+    every socket, and the poster's own refresh must include the comment.
+    """
+    use_replica = bool(settings.DATABASE_REPLICAS) and not written_within(settings.DB_REPLICA_LAG)
+    token = _replica_reads.set(use_replica)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def reads_from_replica(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with replica_reads():
+            return func(*args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,43 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connections
+from django.db.models import F
+
+from rest_framework.exceptions import ValidationError
+
+from comments.models import Comment
+from comments.pagination import keyset_paginate
+from comments.serializers import comment_to_dict
+
+
+MAX_QUERY_LENGTH = 200
+
+
+def search_queryset(query):
+    """Matches for ``query`` and the field their keyset pagination sorts on (descending)."""
+    if connections[Comment.objects.db].vendor == "postgresql":
+        search_query = SearchQuery(query, config="simple", search_type="websearch")
+        queryset = Comment.objects.filter(search_vector=search_query).annotate(
+            rank=SearchRank(F("search_vector"), search_query)
+        )
+        return queryset, "rank"
+    return Comment.objects.filter(text__icontains=query), "created_at"
+
+
+def search_comments(query, page_size=25, cursor=None):
+    query = (query or "").strip()
+    if not query:
+        raise ValidationError("Search query cannot be empty.")
+    if len(query) > MAX_QUERY_LENGTH:
+        raise ValidationError("Search query is too long.")
+
+    queryset, sort_field = search_queryset(query)
+    comments, next_cursor, _ = keyset_paginate(queryset, sort_field, True, page_size, cursor)
+    results = []
+    for comment in comments:
+        comment.loaded_replies = []
+        result = comment_to_dict(comment)
+        result["parent_id"] = comment.reply_id
+        result["thread_id"] = comment.thread_id
+        result["rank"] = getattr(comment, "rank", None)
+        results.append(result)
+    return results, next_cursor
@@ -0,0 +1,73 @@
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+SEQUENCE_KEY = "comments:sequence"
+# Random id of the current run of the counters. The cache is not durable:
+# if it loses the counters they restart at 0, so every version, seq and
+# ETag is only meaningful together with the epoch it was issued in.
+EPOCH_KEY = "comments:sequence:epoch"
+LAST_WRITE_KEY = "comments:last_write"
+ROOTS_TOPIC = "roots"
+
+
+def topic_key(topic):
+    return f"{SEQUENCE_KEY}:{topic}"
+
+
+def thread_topic(thread_id):
+    return f"thread:{thread_id}"
+
+
+def comment_topic(comment):
+    return ROOTS_TOPIC if comment.reply_id is None else thread_topic(comment.root_id)
+
+
+def current_sequence():
+    return cache.get(SEQUENCE_KEY, 0)
+
+
+def current_epoch():
+    epoch = cache.get(EPOCH_KEY)
+    if epoch is None:
+        cache.add(EPOCH_KEY, uuid.uuid4().hex, timeout=None)
+        epoch = cache.get(EPOCH_KEY)
+    return epoch
+
+
+def current_version():
+    """(epoch, sequence) read together."""
+    values = cache.get_many([EPOCH_KEY, SEQUENCE_KEY])
+    if EPOCH_KEY not in values:
+        return current_epoch(), values.get(SEQUENCE_KEY, 0)
+    return values[EPOCH_KEY], values.get(SEQUENCE_KEY, 0)
+
+
+def current_topic_sequences(topics):
+    values = cache.get_many([topic_key(topic) for topic in topics])
+    return {topic: values.get(topic_key(topic), 0) for topic in topics}
+
+
+def increment(key):
+    created = cache.add(key, 0, timeout=None)
+    return cache.incr(key), created
+
+
+def written_within(seconds):
+    written_at = cache.get(LAST_WRITE_KEY)
+    return written_at is not None and time.time() - written_at < seconds
+
+
+def next_sequence(topic=None):
+    version, restarted = increment(SEQUENCE_KEY)
+    if restarted:
+        # Versions from before are being reused: start a new epoch.
+        cache.set(EPOCH_KEY, uuid.uuid4().hex, timeout=None)
+    if settings.DATABASE_REPLICAS:
+        cache.set(LAST_WRITE_KEY, time.time(), timeout=None)
+    if topic is None:
+        return version
+    return version, increment(topic_key(topic))[0]
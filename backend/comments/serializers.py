@@ -1,20 +1,20 @@
-import sys
-from io import BytesIO
-
-from PIL import Image
-
-from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.core.files.base import ContentFile
+from django.utils import timezone
 from rest_framework import serializers
 
+from comments.images import thumbnail
 from comments.models import Comment
+from comments.pagination import encode_cursor
 
 
 class CommentListSerializer(serializers.ModelSerializer):
-    username = serializers.CharField(source="user.username", read_only=True)
+    username = serializers.CharField(source="author_username", read_only=True)
     replies = serializers.SerializerMethodField()
-    email = serializers.CharField(source="user.email", read_only=True)
+    replies_cursor = serializers.SerializerMethodField()
+    email = serializers.CharField(source="author_email", read_only=True)
     image = serializers.ImageField(required=False)
-
+    image_srcset = serializers.SerializerMethodField()
+    image_webp_srcset = serializers.SerializerMethodField()
 
     class Meta:
         model = Comment
@@ -26,41 +26,88 @@ class CommentListSerializer(serializers.ModelSerializer):
             "text",
             "replies",
             "email",
-            "image"
+            "image",
+            "image_srcset",
+            "image_webp_srcset",
+            "reply_count",
+            "last_reply_at",
+            "replies_cursor"
             )
 
     @staticmethod
     def get_replies(obj):
+        if hasattr(obj, "loaded_replies"):
+            return CommentListSerializer(obj.loaded_replies, many=True).data
         if obj.replies.exists():
             return CommentListSerializer(obj.replies.all(), many=True).data
         return []
-    
+
+    @staticmethod
+    def get_replies_cursor(obj):
+        return replies_cursor(obj)
+
+    @staticmethod
+    def get_image_srcset(obj):
+        return srcset(obj, "image")
+
+    @staticmethod
+    def get_image_webp_srcset(obj):
+        return srcset(obj, "webp")
 
     @staticmethod
     def validate_image(image):
         if image:
             try:
-                img = Image.open(image)
-                if img.format not in ["JPEG", "PNG", "GIF"]:
-                    raise serializers.ValidationError("Invalid image type. Allowed types: JPG, PNG, GIF.")
-            except IOError:
-                raise serializers.ValidationError("Invalid file. Please upload a valid image.")
-        
-            max_width = 320
-            max_height = 240
-            if img.width > max_width or img.height > max_height:
-                img.thumbnail((max_width, max_height), Image.Resampling.LANCZOS)
-                image_buffer = BytesIO()
-                img_format = img.format if img.format else 'JPEG'
-                img.save(image_buffer, format=img_format)
-                image_buffer.seek(0)
-
-                return InMemoryUploadedFile(
-                    image_buffer,
-                    None,  
-                    f"{image.name.split('.')[0]}.{img_format.lower()}", 
-                    f'image/{img_format.lower()}',
-                    sys.getsizeof(image_buffer),
-                    None
-                )
+                content, img_format = thumbnail(image.read())
+            except ValueError as e:
+                raise serializers.ValidationError(str(e))
+            return ContentFile(content, name=f"{image.name.split('.')[0]}.{img_format}")
         return image
+
+
+def format_datetime(value):
+    value = timezone.localtime(value).isoformat()
+    return value[:-6] + "Z" if value.endswith("+00:00") else value
+
+
+def srcset(comment, key):
+    """``srcset`` attribute for one format of the comment's image variants, if it has any."""
+    entries = comment.image_srcset.get(key) if comment.image and comment.image_srcset else None
+    if not entries:
+        return None
+    storage = comment.image.storage
+    return ", ".join(f"{storage.url(name)} {width}w" for name, width in entries)
+
+
+def replies_cursor(comment):
+    """Cursor for load_replies after the replies already loaded, if some were left out."""
+    loaded = getattr(comment, "loaded_replies", None)
+    if not loaded or comment.reply_count <= len(loaded):
+        return None
+    last = loaded[-1]
+    return encode_cursor(last.created_at, last.pk, "next")
+
+
+def comment_to_dict(comment, public=False):
+    """Same output as CommentListSerializer for trees from load_reply_trees, without DRF fields.
+
+    ``public`` leaves out the author's email, for responses served without authentication.
+    """
+    data = {
+        "id": comment.id,
+        "username": comment.author_username,
+        "home_page": comment.home_page,
+        "created_at": format_datetime(comment.created_at),
+        "text": comment.text,
+        "replies": [comment_to_dict(reply, public) for reply in getattr(comment, "loaded_replies", ())],
+        "email": comment.author_email,
+        "image": comment.image.url if comment.image else None,
+        "image_srcset": srcset(comment, "image"),
+        "image_webp_srcset": srcset(comment, "webp"),
+        "reply_count": comment.reply_count,
+        "last_reply_at": format_datetime(comment.last_reply_at) if comment.last_reply_at else None,
+        "replies_cursor": replies_cursor(comment),
+    }
+    if public:
+        del data["email"]
+    return data
@@ -0,0 +1,38 @@
+from django.conf import settings
+from django.db.models import Case, F, Value, When
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from comments.models import Comment
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def sync_comment_authors(sender, instance, created, **kwargs):
+    if created:
+        return
+    Comment.objects.filter(user=instance).exclude(
+        author_username=instance.username,
+        author_email=instance.email
+    ).update(author_username=instance.username, author_email=instance.email)
+
+
+@receiver(post_save, sender=Comment)
+def count_new_reply(sender, instance, created, **kwargs):
+    if not created or instance.reply_id is None:
+        return
+    Comment.objects.filter(pk=instance.reply_id).update(
+        reply_count=F("reply_count") + 1,
+        last_reply_at=Case(
+            When(last_reply_at__gt=instance.created_at, then=F("last_reply_at")),
+            default=Value(instance.created_at),
+        ),
+    )
+
+
+@receiver(post_delete, sender=Comment)
+def count_deleted_reply(sender, instance, **kwargs):
+    if instance.reply_id is None:
+        return
+    Comment.objects.filter(pk=instance.reply_id, reply_count__gt=0).update(
+        reply_count=F("reply_count") - 1
+    )
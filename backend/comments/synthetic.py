@@ -0,0 +1,142 @@
+import random
+from array import array
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.utils import timezone
+
+from comments.models import Comment
+
+
+SYLLABLES = ("ka", "lo", "mi", "ne", "su", "ra", "to", "vi", "de", "po", "an", "el", "or", "un", "is")
+
+
+def vocabulary(size=2000):
+    words = [first + second + third for first in SYLLABLES for second in SYLLABLES for third in SYLLABLES]
+    return words[:size]
+
+
+class TextGenerator:
+    """Comment texts with Zipf-like word frequencies, like natural language."""
+
+    def __init__(self, rng, words=None):
+        self.rng = rng
+        self.words = words or vocabulary()
+        self.cum_weights = []
+        total = 0.0
+        for rank in range(len(self.words)):
+            total += 1 / (rank + 1)
+            self.cum_weights.append(total)
+
+    def __call__(self):
+        count = self.rng.randint(5, 30)
+        return " ".join(self.rng.choices(self.words, cum_weights=self.cum_weights, k=count))
+
+
+def thread_shape(rng, fanout, max_depth, max_size):
+    """Parent index of every node in one thread; node 0 is the root.
+
+    Most roots get no replies. A Pareto-distributed "heat" occasionally
+    makes a thread go viral, and fan-out decays with depth.
+    """
+    heat = fanout * rng.paretovariate(1.5)
+    parents = [None]
+    depths = [0]
+    node = 0
+    while node < len(parents) and len(parents) < max_size:
+        depth = depths[node]
+        if depth < max_depth:
+            mean = heat / (depth + 1) ** 2
+            children = 0
+            # Geometric number of children with the given mean.
+            while rng.random() < mean / (mean + 1):
+                children += 1
+            for _ in range(min(children, max_size - len(parents))):
+                parents.append(node)
+                depths.append(depth + 1)
+        node += 1
+    return parents
+
+
+@contextmanager
+def explicit_created_at():
+    field = Comment._meta.get_field("created_at")
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+def load_users(count, prefix="synthetic", batch_size=5000):
+    """Insert ``count`` users and return their ids; yields (inserted, ids) per batch."""
+    password = make_password("Password1")
+    ids = array("q")
+    User = get_user_model()
+    for start in range(0, count, batch_size):
+        users = [
+            User(username=f"{prefix}{index}", email=f"{prefix}{index}@example.com", password=password)
+            for index in range(start, min(start + batch_size, count))
+        ]
+        ids.extend(user.pk for user in User.objects.bulk_create(users))
+        yield len(ids), ids
+
+
+def load_comments(count, author_ids, prefix="synthetic", batch_size=5000, seed=0, days=365,
+                  fanout=0.6, max_depth=8, max_thread_size=5000):
+    """Insert about ``count`` comments as whole threads; yields the running total per batch.
+
+    Threads are generated until a batch is full and then inserted one
+    depth level at a time, so parents have ids before their replies and
+    memory stays bounded by the batch (plus one thread).
+    """
+    rng = random.Random(seed)
+    text = TextGenerator(rng)
+    now = timezone.now()
+    inserted = 0
+    with explicit_created_at():
+        while inserted < count:
+            levels = []
+            size = 0
+            while size < batch_size and inserted + size < count:
+                shape = thread_shape(rng, fanout, max_depth, min(max_thread_size, count - inserted - size))
+                size += len(shape)
+                build_thread(shape, levels, rng, text, author_ids, prefix, now, days)
+            for level in levels:
+                for comment in level:
+                    if comment.reply is not None:
+                        comment.reply_id = comment.reply.pk
+                        comment.root_id = comment.reply.root_id or comment.reply.pk
+                Comment.objects.bulk_create(level, batch_size=batch_size)
+            inserted += size
+            yield inserted
+
+
+def build_thread(shape, levels, rng, text, author_ids, prefix, now, days):
+    nodes = []
+    for parent_index in shape:
+        parent = nodes[parent_index] if parent_index is not None else None
+        if parent is None:
+            created_at = now - timedelta(seconds=rng.uniform(0, days * 86400))
+            depth = 0
+        else:
+            created_at = parent.created_at + timedelta(minutes=rng.expovariate(1 / 30))
+            depth = parent.depth + 1
+            parent.reply_count += 1
+            parent.last_reply_at = max(parent.last_reply_at or created_at, created_at)
+        author = rng.randrange(len(author_ids))
+        comment = Comment(
+            user_id=author_ids[author],
+            author_username=f"{prefix}{author}",
+            author_email=f"{prefix}{author}@example.com",
+            reply=parent,
+            text=text(),
+            created_at=created_at,
+        )
+        comment.depth = depth
+        nodes.append(comment)
+        while len(levels) <= depth:
+            levels.append([])
+        levels[depth].append(comment)
@@ -1,3 +1,1434 @@
-from django.test import TestCase
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from io import BytesIO
+from unittest import mock
 
-# Create your tests here.
+from PIL import Image
+from prometheus_client import REGISTRY
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+import msgpack
+
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+
+from comments.benchmark import compare_encodings, run_benchmark, summarize
+from comments.coalescing import Coalescer, group_coalescer
+from comments.consumers import CommentConsumer
+from comments.frames import build_upload_frame, parse_upload_frame
+from comments.images import process_base64_image, process_image, render_variants, thumbnail
+from comments import db, metrics, throttling
+from comments.outbox import Outbox, OutboxFull
+from comments.pagination import encode_cursor, parse_page_size
+from comments.models import Comment
+from comments.serializers import CommentListSerializer, comment_to_dict
+from comments.synthetic import load_comments, load_users
+from comments.tree import load_reply_trees
+from comments.write_buffer import WriteBuffer, write_buffer
+
+
+@asynccontextmanager
+async def capture_queries():
+    queries = []
+
+    def observe(execute, sql, params, many, context):
+        queries.append(sql)
+        return execute(sql, params, many, context)
+
+    db.query_observers.append(observe)
+    try:
+        yield queries
+    finally:
+        db.query_observers.remove(observe)
+
+
+async def open_socket(user):
+    communicator = WebsocketCommunicator(CommentConsumer.as_asgi(), "/ws/comments/")
+    communicator.scope["user"] = user
+    connected, _ = await communicator.connect()
+    assert connected
+    await communicator.receive_json_from()
+    return communicator
+
+
+class CommentConsumerBroadcastTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = get_user_model().objects.create_user(
+            username="alice", email="zz@example.com", password="Password1"
+        )
+        self.bob = get_user_model().objects.create_user(
+            username="bob", email="aa@example.com", password="Password1"
+        )
+        Comment.objects.create(user=self.alice, text="first")
+
+    @override_settings(COMMENTS_BROADCAST_MODE="page")
+    async def test_broadcast_sends_each_socket_its_own_sort(self):
+        by_date = await open_socket(self.alice)
+        by_email = await open_socket(self.bob)
+        await by_email.send_json_to({
+            "action": "list_comments", "sort_by": "email", "sort_order": "asc"
+        })
+        await by_email.receive_json_from()
+
+        await by_email.send_json_to({"action": "create_comment", "text": "second"})
+        date_page = await by_date.receive_json_from()
+        saved = await by_email.receive_json_from()
+        email_page = await by_email.receive_json_from()
+
+        self.assertEqual(saved["action"], "comment_saved")
+        self.assertEqual([c["text"] for c in date_page["comments"]], ["second", "first"])
+        self.assertEqual([c["email"] for c in email_page["comments"]], ["aa@example.com", "zz@example.com"])
+        await by_date.disconnect()
+        await by_email.disconnect()
+
+    async def test_broadcast_renders_pages_once_per_sort_key(self):
+        sockets = [await open_socket(self.alice) for _ in range(4)]
+        async with capture_queries() as rendered:
+            pages = await CommentConsumer().render_first_pages()
+        async with capture_queries() as forwarded:
+            await get_channel_layer().group_send(
+                CommentConsumer.page_group_name("date:desc"),
+                {"type": "broadcast_comments", "page": pages["date:desc"]}
+            )
+            payloads = [json.loads(await socket.receive_from()) for socket in sockets]
+
+        self.assertEqual(len(pages), len(CommentConsumer.SORTING) * 2)
+        self.assertGreater(len(rendered), 0)
+        self.assertEqual(len(forwarded), 0)
+        self.assertEqual([p["action"] for p in payloads], ["list_comments"] * 4)
+        for socket in sockets:
+            await socket.disconnect()
+
+
+class CommentConsumerDeltaTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            username="carol", email="carol@example.com", password="Password1"
+        )
+        self.root = Comment.objects.create(user=self.user, text="root")
+
+    async def test_new_comment_is_sent_as_delta_with_next_sequence(self):
+        communicator = WebsocketCommunicator(CommentConsumer.as_asgi(), "/ws/comments/")
+        communicator.scope["user"] = self.user
+        await communicator.connect()
+        initial = await communicator.receive_json_from()
+
+        await communicator.send_json_to({
+            "action": "create_comment", "text": "reply", "reply_id": self.root.id
+        })
+        saved = await communicator.receive_json_from()
+        event = await communicator.receive_json_from()
+
+        self.assertEqual(saved, {
+            "action": "comment_saved", "id": event["comment"]["id"], "topic": event["topic"],
+            "epoch": event["epoch"], "seq": event["seq"]
+        })
+        self.assertEqual(event["action"], "comment_created")
+        self.assertEqual(event["topic"], f"thread:{self.root.id}")
+        self.assertEqual(event["seq"], initial["seqs"][f"thread:{self.root.id}"] + 1)
+        self.assertEqual(event["version"], initial["seq"] + 1)
+        self.assertEqual(event["parent_id"], self.root.id)
+        self.assertEqual(event["comment"]["text"], "reply")
+        self.assertEqual(event["sort_keys"]["username"], "carol")
+        self.assertNotIn("comments", event)
+        await communicator.disconnect()
+
+    async def test_list_comments_reports_current_sequence_for_resync(self):
+        communicator = await open_socket(self.user)
+        await communicator.send_json_to({"action": "create_comment", "text": "new"})
+        await communicator.receive_json_from()
+        event = await communicator.receive_json_from()
+
+        await communicator.send_json_to({"action": "list_comments"})
+        resync = await communicator.receive_json_from()
+
+        self.assertEqual(resync["seq"], event["version"])
+        self.assertEqual(resync["seqs"]["roots"], event["seq"])
+        self.assertEqual(resync["comments"][0]["text"], "new")
+        await communicator.disconnect()
+
+
+class CommentSubscriptionTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            username="judy", email="judy@example.com", password="Password1"
+        )
+        self.old_root = Comment.objects.create(user=self.user, text="old root")
+        self.roots = [Comment.objects.create(user=self.user, text=f"root {i}") for i in range(2)]
+
+    async def reply(self, socket, root, text="reply"):
+        await socket.send_json_to({"action": "create_comment", "text": text, "reply_id": root.id})
+
+    async def test_replies_reach_only_sockets_showing_the_thread(self):
+        first_page = await open_socket(self.user)
+        await first_page.send_json_to({"action": "list_comments", "page": 1, "page_size": 2})
+        await first_page.receive_json_from()
+        second_page = await open_socket(self.user)
+        await second_page.send_json_to({"action": "list_comments", "page": 2, "page_size": 2})
+        await second_page.receive_json_from()
+
+        await self.reply(second_page, self.old_root, "to old")
+        await second_page.receive_json_from()
+        old_event = await second_page.receive_json_from()
+        await self.reply(second_page, self.roots[1], "to new")
+        await second_page.receive_json_from()
+        new_event = await first_page.receive_json_from()
+
+        self.assertEqual(old_event["comment"]["text"], "to old")
+        self.assertEqual(new_event["comment"]["text"], "to new")
+        self.assertTrue(await first_page.receive_nothing())
+        self.assertTrue(await second_page.receive_nothing())
+        await first_page.disconnect()
+        await second_page.disconnect()
+
+    async def test_new_roots_go_to_first_pages_and_their_replies_follow(self):
+        first_page = await open_socket(self.user)
+        second_page = await open_socket(self.user)
+        await second_page.send_json_to({"action": "list_comments", "page": 2, "page_size": 2})
+        await second_page.receive_json_from()
+
+        await second_page.send_json_to({"action": "create_comment", "text": "brand new"})
+        created = await first_page.receive_json_from()
+        await second_page.receive_json_from()
+        root = await Comment.objects.aget(pk=created["comment"]["id"])
+        await self.reply(second_page, root)
+        reply = await first_page.receive_json_from()
+        await second_page.receive_json_from()
+
+        self.assertEqual(created["topic"], "roots")
+        self.assertEqual((reply["topic"], reply["seq"]), (f"thread:{root.id}", 1))
+        self.assertTrue(await second_page.receive_nothing())
+        await first_page.disconnect()
+        await second_page.disconnect()
+
+    async def test_new_roots_past_the_first_page_are_not_followed(self):
+        oldest_first = await open_socket(self.user)
+        await oldest_first.send_json_to({
+            "action": "list_comments", "page": 1, "page_size": 2, "sort_by": "date", "sort_order": "asc"
+        })
+        await oldest_first.receive_json_from()
+        poster = await open_socket(self.user)
+
+        await poster.send_json_to({"action": "create_comment", "text": "brand new"})
+        created = await oldest_first.receive_json_from()
+        await poster.receive_json_from()
+        await poster.receive_json_from()
+        root = await Comment.objects.aget(pk=created["comment"]["id"])
+        await self.reply(poster, root)
+        await poster.receive_json_from()
+        await poster.receive_json_from()
+
+        self.assertEqual(created["sort_keys"]["date"], created["comment"]["created_at"])
+        self.assertTrue(await oldest_first.receive_nothing())
+        await oldest_first.disconnect()
+        await poster.disconnect()
+
+    async def test_explicit_thread_subscription_survives_page_changes(self):
+        socket = await open_socket(self.user)
+        await socket.send_json_to({"action": "subscribe_thread", "root_id": self.old_root.id})
+        subscribed = await socket.receive_json_from()
+        await socket.send_json_to({"action": "list_comments", "page": 1, "page_size": 1})
+        await socket.receive_json_from()
+
+        await self.reply(socket, self.old_root)
+        await socket.receive_json_from()
+        event = await socket.receive_json_from()
+        await socket.send_json_to({"action": "unsubscribe_thread", "root_id": self.old_root.id})
+        await socket.receive_json_from()
+        await self.reply(socket, self.old_root)
+        await socket.receive_json_from()
+
+        self.assertEqual(subscribed["seqs"], {f"thread:{self.old_root.id}": 0})
+        self.assertEqual(event["parent_id"], self.old_root.id)
+        self.assertTrue(await socket.receive_nothing())
+        await socket.disconnect()
+
+    @override_settings(COMMENTS_MAX_THREAD_SUBSCRIPTIONS=1)
+    async def test_explicit_subscriptions_must_be_roots_and_are_capped(self):
+        reply = await Comment.objects.acreate(user=self.user, text="reply", reply=self.old_root)
+        socket = await open_socket(self.user)
+
+        for root_id in (reply.id, 999999):
+            await socket.send_json_to({"action": "subscribe_thread", "root_id": root_id})
+            self.assertEqual(await socket.receive_json_from(), {"error": "Thread not found."})
+        await socket.send_json_to({"action": "subscribe_thread", "root_id": self.old_root.id})
+        self.assertEqual((await socket.receive_json_from())["action"], "subscribe_thread")
+        await socket.send_json_to({"action": "subscribe_thread", "root_id": self.roots[0].id})
+        self.assertEqual(await socket.receive_json_from(), {"error": "Too many thread subscriptions."})
+        await socket.send_json_to({"action": "subscribe_thread", "root_id": self.old_root.id})
+        self.assertEqual((await socket.receive_json_from())["action"], "subscribe_thread")
+        await socket.disconnect()
+
+    @override_settings(
+        COMMENTS_CONNECTION_THROTTLE_RATES={"subscribe_thread": (0.001, 1)}, COMMENTS_USER_THROTTLE_RATES={}
+    )
+    async def test_subscriptions_are_rate_limited(self):
+        socket = await open_socket(self.user)
+        for _ in range(2):
+            await socket.send_json_to({"action": "subscribe_thread", "root_id": self.old_root.id})
+        await socket.receive_json_from()
+
+        self.assertEqual((await socket.receive_json_from())["error"], "Rate limit exceeded")
+        await socket.disconnect()
+
+    def test_root_is_inherited_through_nested_replies(self):
+        child = Comment.objects.create(user=self.user, text="child", reply=self.old_root)
+        grandchild = Comment.objects.create(user=self.user, text="grandchild", reply=child)
+
+        self.assertIsNone(self.old_root.root_id)
+        self.assertEqual(child.root_id, self.old_root.id)
+        self.assertEqual(grandchild.thread_id, self.old_root.id)
+
+
+class PayloadEncodingTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            username="kate", email="kate@example.com", password="Password1"
+        )
+        root = Comment.objects.create(user=self.user, text="root", home_page="https://example.com")
+        child = Comment.objects.create(user=self.user, text="child", reply=root)
+        Comment.objects.create(user=self.user, text="grandchild", reply=child)
+
+    def test_plain_dicts_match_the_drf_serializer(self):
+        comments = load_reply_trees(list(Comment.objects.filter(reply=None)))
+
+        self.assertEqual(
+            json.loads(json.dumps([comment_to_dict(c) for c in comments])),
+            json.loads(json.dumps(CommentListSerializer(comments, many=True).data))
+        )
+
+    def test_encoding_benchmark_reports_every_path(self):
+        comments = load_reply_trees(list(Comment.objects.filter(reply=None)))
+
+        results = compare_encodings(comments, rounds=2)
+
+        self.assertEqual(set(results), {"drf+json", "dict+orjson", "dict+msgpack"})
+        self.assertLess(results["dict+msgpack"]["bytes"], results["dict+orjson"]["bytes"])
+
+    async def test_msgpack_subprotocol_sends_binary_frames(self):
+        communicator = WebsocketCommunicator(
+            CommentConsumer.as_asgi(), "/ws/comments/", subprotocols=["comments.msgpack"]
+        )
+        communicator.scope["user"] = self.user
+        connected, subprotocol = await communicator.connect()
+        page = msgpack.unpackb(await communicator.receive_from())
+
+        await communicator.send_json_to({"action": "create_comment", "text": "packed"})
+        saved = msgpack.unpackb(await communicator.receive_from())
+        event = msgpack.unpackb(await communicator.receive_from())
+
+        self.assertTrue(connected)
+        self.assertEqual(subprotocol, "comments.msgpack")
+        self.assertEqual(page["comments"][0]["replies"][0]["text"], "child")
+        self.assertEqual(saved["id"], event["comment"]["id"])
+        self.assertEqual(event["comment"]["text"], "packed")
+        await communicator.disconnect()
+
+
+class ReplyTreeLoadingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(
+            username="dave", email="dave@example.com", password="Password1"
+        )
+
+    def create_thread(self, depth):
+        root = parent = Comment.objects.create(user=self.user, text="root")
+        for level in range(depth):
+            parent = Comment.objects.create(user=self.user, text=f"level {level}", reply=parent)
+        return root
+
+    def count_page_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            comments, _ = CommentConsumer().fetch_comments(1, 25, "date", "desc")
+        return len(queries), comments
+
+    def test_query_count_does_not_depend_on_thread_depth(self):
+        self.create_thread(depth=2)
+        shallow_queries, _ = self.count_page_queries()
+
+        self.create_thread(depth=12)
+        deep_queries, comments = self.count_page_queries()
+
+        self.assertEqual(shallow_queries, deep_queries)
+        node, depth = comments[0], 0
+        while node["replies"]:
+            node, depth = node["replies"][0], depth + 1
+        self.assertEqual(depth, 12)
+        self.assertEqual(node["username"], "dave")
+
+    def test_replies_are_attached_to_their_parents(self):
+        root = Comment.objects.create(user=self.user, text="root")
+        first = Comment.objects.create(user=self.user, text="first", reply=root)
+        Comment.objects.create(user=self.user, text="second", reply=root)
+        Comment.objects.create(user=self.user, text="nested", reply=first)
+
+        [loaded] = load_reply_trees([root])
+
+        self.assertEqual([r.text for r in loaded.loaded_replies], ["first", "second"])
+        self.assertEqual([r.text for r in loaded.loaded_replies[0].loaded_replies], ["nested"])
+        self.assertEqual(loaded.loaded_replies[1].loaded_replies, [])
+
+
+class ReplyLimitTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            username="liam", email="liam@example.com", password="Password1"
+        )
+        self.root = Comment.objects.create(user=self.user, text="viral")
+        self.replies = [
+            Comment.objects.create(user=self.user, text=f"reply {index}", reply=self.root)
+            for index in range(7)
+        ]
+        Comment.objects.create(user=self.user, text="nested", reply=self.replies[0])
+
+    def test_reply_counts_are_maintained_on_write(self):
+        self.root.refresh_from_db()
+        self.assertEqual(self.root.reply_count, 7)
+        self.assertEqual(self.root.last_reply_at, self.replies[-1].created_at)
+
+        self.replies[-1].delete()
+        self.root.refresh_from_db()
+        self.assertEqual(self.root.reply_count, 6)
+
+    def test_limited_trees_load_first_replies_with_a_cursor_for_the_rest(self):
+        comments, _ = CommentConsumer().fetch_comments(1, 25, "date", "desc", replies_limit=2)
+
+        [root] = comments
+        self.assertEqual([r["text"] for r in root["replies"]], ["reply 0", "reply 1"])
+        self.assertEqual(root["reply_count"], 7)
+        self.assertIsNotNone(root["replies_cursor"])
+        self.assertEqual([r["text"] for r in root["replies"][0]["replies"]], ["nested"])
+        self.assertIsNone(root["replies"][0]["replies_cursor"])
+
+    def test_limited_trees_match_the_drf_serializer(self):
+        [root] = load_reply_trees(Comment.objects.filter(reply=None), limit=2)
+
+        self.assertEqual(
+            json.loads(json.dumps(comment_to_dict(root))),
+            json.loads(json.dumps(CommentListSerializer(root).data))
+        )
+
+    async def test_load_replies_pages_through_a_thread(self):
+        socket = await open_socket(self.user)
+        await socket.send_json_to({"action": "list_comments", "replies_limit": 2})
+        page = await socket.receive_json_from()
+        cursor = page["comments"][0]["replies_cursor"]
+        loaded = [r["text"] for r in page["comments"][0]["replies"]]
+
+        while cursor:
+            await socket.send_json_to({
+                "action": "load_replies", "parent_id": self.root.id, "cursor": cursor, "page_size": 2
+            })
+            response = await socket.receive_json_from()
+            self.assertEqual(response["parent_id"], self.root.id)
+            loaded += [r["text"] for r in response["replies"]]
+            cursor = response["next_cursor"]
+
+        self.assertEqual(loaded, [f"reply {index}" for index in range(7)])
+        await socket.disconnect()
+
+    async def test_load_replies_page_size_is_validated(self):
+        socket = await open_socket(self.user)
+        await socket.send_json_to({"action": "load_replies", "parent_id": self.root.id, "page_size": "x"})
+        self.assertEqual(await socket.receive_json_from(), {"error": "Invalid page_size."})
+
+        await socket.send_json_to({"action": "load_replies", "parent_id": self.root.id, "page_size": -1})
+        self.assertEqual(len((await socket.receive_json_from())["replies"]), 1)
+        await socket.disconnect()
+
+    async def test_cursor_page_size_from_the_client_is_validated(self):
+        socket = await open_socket(self.user)
+        await socket.send_json_to({"action": "list_comments", "pagination": "cursor", "page_size": "1"})
+        self.assertEqual(len((await socket.receive_json_from())["comments"]), 1)
+
+        await socket.send_json_to({"action": "list_comments", "pagination": "cursor", "page_size": "x"})
+        self.assertEqual(await socket.receive_json_from(), {"error": "Invalid page_size."})
+        await socket.disconnect()
+
+    async def test_invalid_reply_limit_is_rejected(self):
+        socket = await open_socket(self.user)
+        await socket.send_json_to({"action": "list_comments", "replies_limit": "all"})
+
+        self.assertEqual(await socket.receive_json_from(), {"error": "Invalid replies_limit."})
+        await socket.disconnect()
+
+
+class CommentSearchTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            username="mona", email="mona@example.com", password="Password1"
+        )
+        root = Comment.objects.create(user=self.user, text="the quick brown fox")
+        for index in range(3):
+            Comment.objects.create(user=self.user, text=f"another fox {index}", reply=root)
+        Comment.objects.create(user=self.user, text="lazy dog")
+
+    async def test_search_action_pages_through_matches(self):
+        socket = await open_socket(self.user)
+        texts, cursor = [], None
+        while True:
+            await socket.send_json_to({
+                "action": "search_comments", "query": "fox", "page_size": 3, "cursor": cursor
+            })
+            response = await socket.receive_json_from()
+            texts += [result["text"] for result in response["results"]]
+            cursor = response["next_cursor"]
+            if cursor is None:
+                break
+
+        self.assertEqual(len(texts), 4)
+        self.assertEqual(set(texts), {"the quick brown fox", "another fox 0", "another fox 1", "another fox 2"})
+        await socket.disconnect()
+
+    async def test_empty_queries_are_rejected(self):
+        socket = await open_socket(self.user)
+        await socket.send_json_to({"action": "search_comments", "query": "  "})
+
+        self.assertEqual(await socket.receive_json_from(), {"error": "Search query cannot be empty."})
+        await socket.disconnect()
+
+    def test_http_search_requires_authentication(self):
+        client = APIClient()
+        self.assertEqual(client.get("/comments/search/", {"q": "dog"}).status_code, 401)
+
+        client.force_authenticate(self.user)
+        response = client.get("/comments/search/", {"q": "dog"})
+
+        self.assertEqual(response.status_code, 200)
+        [result] = response.json()["results"]
+        self.assertEqual((result["text"], result["parent_id"]), ("lazy dog", None))
+
+    def test_http_search_rejects_tampered_cursors(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        response = client.get("/comments/search/", {"q": "fox", "cursor": encode_cursor("garbage", 1, "next")})
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_http_search_page_size_is_clamped(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        response = client.get("/comments/search/", {"q": "fox", "page_size": -5})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["results"]), 4)
+
+    async def test_search_action_page_size_is_clamped(self):
+        socket = await open_socket(self.user)
+        await socket.send_json_to({"action": "search_comments", "query": "fox", "page_size": 0})
+        self.assertEqual(len((await socket.receive_json_from())["results"]), 1)
+
+        await socket.send_json_to({"action": "search_comments", "query": "fox", "page_size": "many"})
+        self.assertEqual(await socket.receive_json_from(), {"error": "Invalid page_size."})
+        await socket.disconnect()
+
+
+
+class CommentHttpReadTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            username="nora", email="nora@example.com", password="Password1"
+        )
+        self.root = self.create_comment("root")
+
+    def create_comment(self, text, reply=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            return CommentConsumer.create_comment_in_transaction(self.user, text, None, reply)
+
+    def test_unchanged_page_is_revalidated_without_queries(self):
+        response = self.client.get("/comments/", {"sort_by": "email", "sort_order": "asc"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["action"], "list_comments")
+        self.assertEqual([c["text"] for c in response.json()["comments"]], ["root"])
+        self.assertIn("public", response["Cache-Control"])
+
+        with self.assertNumQueries(0):
+            revalidated = self.client.get(
+                "/comments/", {"sort_by": "email", "sort_order": "asc"}, HTTP_IF_NONE_MATCH=response["ETag"]
+            )
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated["ETag"], response["ETag"])
+
+        self.create_comment("second")
+        changed = self.client.get(
+            "/comments/", {"sort_by": "email", "sort_order": "asc"}, HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed["ETag"], response["ETag"])
+        self.assertEqual(len(changed.json()["comments"]), 2)
+
+    def test_thread_etag_follows_its_own_replies(self):
+        response = self.client.get(f"/comments/threads/{self.root.pk}/")
+        self.assertEqual(response.json()["comment"]["text"], "root")
+
+        self.create_comment("elsewhere")
+        self.assertEqual(
+            self.client.get(f"/comments/threads/{self.root.pk}/", HTTP_IF_NONE_MATCH=response["ETag"]).status_code,
+            304
+        )
+
+        reply = self.create_comment("reply", reply=self.root)
+        changed = self.client.get(f"/comments/threads/{self.root.pk}/", HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual([r["text"] for r in changed.json()["comment"]["replies"]], ["reply"])
+        self.assertEqual(self.client.get(f"/comments/threads/{reply.pk}/").status_code, 404)
+
+    def test_replies_limit_is_read_from_the_query_string(self):
+        for index in range(2):
+            self.create_comment(f"reply {index}", reply=self.root)
+
+        response = self.client.get(f"/comments/threads/{self.root.pk}/", {"replies_limit": "1"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r["text"] for r in response.json()["comment"]["replies"]], ["reply 0"])
+        for value in ("many", "-1"):
+            self.assertEqual(self.client.get("/comments/", {"replies_limit": value}).status_code, 400)
+
+    def test_counter_reset_starts_a_new_epoch(self):
+        response = self.client.get("/comments/")
+        thread = self.client.get(f"/comments/threads/{self.root.pk}/")
+
+        cache.clear()
+        comment = self.create_comment("after the reset")
+        reply = self.create_comment("reply after the reset", reply=self.root)
+
+        self.assertEqual((comment.version, response.json()["seq"]), (1, 1))
+        self.assertNotEqual(comment.epoch, response.json()["epoch"])
+        changed = self.client.get("/comments/", HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(changed.json()["epoch"], comment.epoch)
+        self.assertIn("after the reset", [c["text"] for c in changed.json()["comments"]])
+        self.assertEqual(reply.seq, 1)
+        self.assertEqual(
+            self.client.get(f"/comments/threads/{self.root.pk}/", HTTP_IF_NONE_MATCH=thread["ETag"]).status_code,
+            200
+        )
+
+    def test_public_payloads_leave_out_author_emails(self):
+        self.create_comment("reply", reply=self.root)
+        CommentConsumer().render_comments_page(1, 25, "date", "desc", replies_limit=settings.COMMENTS_REPLIES_LIMIT)
+
+        page = self.client.get("/comments/").json()
+        thread = self.client.get(f"/comments/threads/{self.root.pk}/").json()
+
+        for comment in (page["comments"][0], thread["comment"]):
+            self.assertNotIn("email", comment)
+            self.assertNotIn("email", comment["replies"][0])
+        self.assertNotIn(b"nora@example.com", self.client.get("/comments/").content)
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        users = [
+            get_user_model().objects.create_user(
+                username=name, email=f"{name}@example.com", password="Password1"
+            )
+            for name in ("erin", "frank", "grace")
+        ]
+        for index in range(7):
+            Comment.objects.create(user=users[index % 3], text=f"comment {index}")
+
+    def walk(self, sort_by, sort_order):
+        consumer = CommentConsumer()
+        pages, cursor = [], None
+        while True:
+            comments, cursor, prev_cursor, _ = consumer.fetch_comments_by_cursor(
+                cursor, 3, sort_by, sort_order, False
+            )
+            pages.append((comments, prev_cursor))
+            if cursor is None:
+                return pages
+
+    def test_cursor_pages_match_offset_ordering_for_every_sort(self):
+        for sort_by in CommentConsumer.SORTING:
+            for sort_order in ("asc", "desc"):
+                expected, _ = CommentConsumer().fetch_comments(1, 25, sort_by, sort_order)
+                pages = self.walk(sort_by, sort_order)
+                walked = [c["id"] for comments, _ in pages for c in comments]
+                key = {"username": "username", "email": "email", "date": "created_at"}[sort_by]
+                self.assertEqual(len(set(walked)), 7)
+                self.assertEqual(
+                    [c[key] for comments, _ in pages for c in comments],
+                    [c[key] for c in expected]
+                )
+
+    def test_prev_cursor_returns_the_previous_page(self):
+        pages = self.walk("username", "asc")
+        consumer = CommentConsumer()
+        first_ids = [c["id"] for c in pages[0][0]]
+        second_prev = pages[1][1]
+
+        comments, next_cursor, prev_cursor, _ = consumer.fetch_comments_by_cursor(
+            second_prev, 3, "username", "asc", False
+        )
+
+        self.assertEqual([c["id"] for c in comments], first_ids)
+        self.assertIsNone(prev_cursor)
+        self.assertIsNotNone(next_cursor)
+
+    def test_count_pages_is_optional(self):
+        consumer = CommentConsumer()
+        *_, without_count = consumer.fetch_comments_by_cursor(None, 3, "date", "desc", False)
+        *_, with_count = consumer.fetch_comments_by_cursor(None, 3, "date", "desc", True)
+        self.assertIsNone(without_count)
+        self.assertEqual(with_count, 3)
+
+    def test_invalid_cursor_is_rejected(self):
+        with self.assertRaises(ValidationError):
+            CommentConsumer().fetch_comments_by_cursor("not-a-cursor", 3, "date", "desc", False)
+
+    def test_cursor_values_of_the_wrong_type_are_rejected(self):
+        for value in ("garbage", None, [1], {"a": 1}):
+            with self.assertRaises(ValidationError):
+                CommentConsumer().fetch_comments_by_cursor(
+                    encode_cursor(value, 1, "next"), 3, "date", "desc", False
+                )
+
+    def test_page_size_is_parsed_and_clamped(self):
+        self.assertEqual(parse_page_size("2"), 2)
+        self.assertEqual(parse_page_size(-5), 1)
+        self.assertEqual(parse_page_size(10 ** 9), 100)
+        self.assertEqual(parse_page_size(None), 25)
+        for value in ("x", True, [3]):
+            with self.assertRaises(ValidationError):
+                parse_page_size(value)
+
+
+class CommentSortIndexTests(TestCase):
+    INDEXES = {
+        "date": "comment_reply_created_idx",
+        "username": "comment_reply_username_idx",
+        "email": "comment_reply_email_idx",
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(
+            username="heidi", email="heidi@example.com", password="Password1"
+        )
+        root = Comment.objects.create(user=cls.user, text="root")
+        Comment.objects.create(user=cls.user, text="reply", reply=root)
+
+    def test_author_fields_are_copied_and_kept_in_sync(self):
+        comment = Comment.objects.get(text="root")
+        self.assertEqual((comment.author_username, comment.author_email), ("heidi", "heidi@example.com"))
+
+        self.user.username = "heidi2"
+        self.user.save()
+
+        self.assertEqual(
+            set(Comment.objects.values_list("author_username", flat=True)), {"heidi2"}
+        )
+
+    def test_every_sort_option_is_served_by_an_index(self):
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("SET enable_seqscan = off")
+        for sort_by, sort in CommentConsumer.SORTING.items():
+            for prefix in ("", "-"):
+                plan = (
+                    Comment.objects.filter(reply=None)
+                    .select_related("user")
+                    .order_by(f"{prefix}{sort}", f"{prefix}pk")[:26]
+                    .explain()
+                )
+                self.assertIn(self.INDEXES[sort_by], plan)
+                self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_text_sorts_by_code_point_like_the_live_comparisons(self):
+        names = ["bob", "Zoe", "a.b", "ab", "_x", "Émile"]
+        for name in names:
+            user = get_user_model().objects.create_user(
+                username=name, email=f"{name}@example.com", password="Password1"
+            )
+            Comment.objects.create(user=user, text=name)
+        for sort_by in ("username", "email"):
+            roots, _ = CommentConsumer().fetch_roots(1, 25, sort_by, "asc")
+            keys = [getattr(root, CommentConsumer.SORTING[sort_by]) for root in roots]
+            self.assertEqual(keys, sorted(keys))
+
+
+class CommentPageCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(
+            username="ivan", email="ivan@example.com", password="Password1"
+        )
+        Comment.objects.create(user=cls.user, text="cached")
+
+    def setUp(self):
+        cache.clear()
+
+    def test_rendered_page_is_served_from_cache(self):
+        consumer = CommentConsumer()
+        first, _ = consumer.render_comments_page(1, 25, "date", "desc")
+        with CaptureQueriesContext(connection) as queries:
+            second, _ = consumer.render_comments_page(1, 25, "date", "desc")
+        self.assertEqual(first, second)
+        self.assertEqual(len(queries), 0)
+
+    def commit_during(self, consumer, method):
+        """Patch ``method`` to commit a new root and a reply right after it fetched the roots."""
+        fetch = getattr(consumer, method)
+        late = []
+
+        def fetch_then_commit(*args):
+            result = fetch(*args)
+            root = Comment.objects.get(text="cached")
+            with self.captureOnCommitCallbacks(execute=True):
+                late.append(CommentConsumer.create_comment_in_transaction(self.user, "late root", None))
+                late.append(CommentConsumer.create_comment_in_transaction(self.user, "late reply", None, root))
+            return result
+
+        return mock.patch.object(consumer, method, side_effect=fetch_then_commit), late
+
+    def test_comments_committed_during_a_render_are_never_counted_but_missing(self):
+        consumer = CommentConsumer()
+        patch, late = self.commit_during(consumer, "fetch_roots")
+        with patch:
+            page = json.loads(consumer.render_comments_page(1, 25, "date", "desc")[0]["json"])
+        late_root, late_reply = late
+
+        self.assertNotIn("late root", [c["text"] for c in page["comments"]])
+        self.assertLess(page["seqs"]["roots"], late_root.seq)
+        [root] = page["comments"]
+        self.assertEqual(page["seqs"][f"thread:{root['id']}"], late_reply.seq)
+        self.assertEqual([r["text"] for r in root["replies"]], ["late reply"])
+
+        consumer = CommentConsumer()
+        patch, late = self.commit_during(consumer, "fetch_roots_by_cursor")
+        with patch:
+            comments, seqs, *_ = consumer.read_page(
+                lambda: consumer.fetch_roots_by_cursor(None, 25, "date", "asc", False), None
+            )
+        self.assertLess(seqs["roots"], late[0].seq)
+        self.assertNotIn(late[0].pk, [c["id"] for c in comments])
+
+    def test_committed_comment_bumps_version_and_invalidates_pages(self):
+        consumer = CommentConsumer()
+        before = json.loads(consumer.render_comments_page(1, 25, "date", "desc")[0]["json"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            comment = CommentConsumer.create_comment_in_transaction(self.user, "fresh", None)
+        after = json.loads(consumer.render_comments_page(1, 25, "date", "desc")[0]["json"])
+
+        self.assertEqual(comment.version, before["seq"] + 1)
+        self.assertEqual(comment.seq, before["seqs"]["roots"] + 1)
+        self.assertEqual(after["seq"], comment.version)
+        self.assertEqual(after["comments"][0]["text"], "fresh")
+
+
+def make_image(size=(800, 600), image_format="PNG"):
+    buffer = BytesIO()
+    Image.new("RGB", size, "red").save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+class ImageProcessingTests(TestCase):
+    def test_large_images_are_thumbnailed(self):
+        content, ext = thumbnail(make_image())
+        self.assertEqual(ext, "png")
+        self.assertEqual(Image.open(BytesIO(content)).size, (320, 240))
+
+    def test_unsupported_formats_are_rejected(self):
+        with self.assertRaisesMessage(ValueError, "Invalid image type"):
+            thumbnail(make_image(image_format="BMP"))
+
+    async def test_base64_upload_is_processed_in_the_pool(self):
+        data_url = "data:image/png;base64," + base64.b64encode(make_image()).decode()
+        image = await process_base64_image(data_url)
+        digest = hashlib.sha256(make_image()).hexdigest()
+        self.assertEqual(image.name, f"chat/images/{digest[:2]}/{digest}.png")
+        self.assertEqual(Image.open(image).size, (320, 240))
+
+    def test_variants_cover_each_width_once_per_format(self):
+        _, name, variants, srcset = render_variants(make_image())
+        self.assertEqual([width for _, width in srcset["image"]], [160, 320, 640])
+        self.assertEqual([width for _, width in srcset["webp"]], [160, 320, 640])
+        self.assertEqual(Image.open(BytesIO(variants[srcset["webp"][0][0]])).format, "WEBP")
+        self.assertNotIn(name, variants)
+
+        _, _, variants, srcset = render_variants(make_image(size=(100, 50)))
+        self.assertEqual([width for _, width in srcset["image"]], [100])
+        self.assertEqual(len(variants), 2)
+
+    @override_settings(COMMENTS_IMAGE_MAX_BYTES=1024)
+    async def test_oversized_upload_is_rejected_before_decoding(self):
+        data_url = "data:image/png;base64," + "A" * 4096
+        with mock.patch("comments.images.run_in_pool") as run_in_pool:
+            with self.assertRaises(ValidationError):
+                await process_base64_image(data_url)
+        run_in_pool.assert_not_called()
+
+    @override_settings(COMMENTS_IMAGE_QUEUE_SIZE=0)
+    async def test_upload_is_rejected_when_the_queue_is_full(self):
+        with self.assertRaisesMessage(ValidationError, "Too many images"):
+            await process_image(make_image())
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class BinaryUploadTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            username="judy", email="judy@example.com", password="Password1"
+        )
+
+    async def test_binary_frame_creates_comment_with_thumbnail(self):
+        communicator = await open_socket(self.user)
+        await communicator.send_to(bytes_data=build_upload_frame(
+            {"action": "create_comment", "text": "with image"}, make_image()
+        ))
+        await communicator.receive_json_from()
+        event = await communicator.receive_json_from()
+
+        self.assertEqual(event["comment"]["text"], "with image")
+        comment = await Comment.objects.aget(pk=event["comment"]["id"])
+        self.assertEqual(Image.open(comment.image.path).size, (320, 240))
+        self.assertEqual(event["comment"]["image"], comment.image.url)
+        self.assertRegex(event["comment"]["image_webp_srcset"], r"^/media/chat/images/\w+/\w+_160\.webp 160w, ")
+        await communicator.disconnect()
+
+    async def test_identical_uploads_share_files(self):
+        communicator = await open_socket(self.user)
+        for text in ("first", "second"):
+            await communicator.send_to(bytes_data=build_upload_frame(
+                {"action": "create_comment", "text": text}, make_image()
+            ))
+            await communicator.receive_json_from()
+            await communicator.receive_json_from()
+
+        images = [comment.image async for comment in Comment.objects.all()]
+        self.assertEqual(images[0].name, images[1].name)
+        directory = os.path.dirname(images[0].path)
+        self.assertEqual(len(os.listdir(directory)), 6)
+        await communicator.disconnect()
+
+    @override_settings(COMMENTS_IMAGE_MAX_BYTES=1024)
+    async def test_oversized_frame_is_rejected(self):
+        communicator = await open_socket(self.user)
+        await communicator.send_to(bytes_data=build_upload_frame(
+            {"action": "create_comment", "text": "too big"}, make_image()
+        ))
+        response = await communicator.receive_json_from()
+
+        self.assertEqual(response, {"error": "Image is too large."})
+        self.assertFalse(await Comment.objects.aexists())
+        await communicator.disconnect()
+
+    def test_malformed_frames_are_rejected(self):
+        for frame in (b"\x00", b"\x00\x00\x00\xff{}", b"\x00\x00\x00\x02[]"):
+            with self.assertRaisesMessage(ValidationError, "Invalid upload frame."):
+                parse_upload_frame(frame)
+
+
+class BenchmarkHarnessTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+
+    async def test_benchmark_reports_latency_and_query_counts(self):
+        from comments_service.asgi import application
+
+        results = await run_benchmark(application, sockets=2, messages=4, create_ratio=0.5)
+
+        self.assertEqual(
+            sum(stats["count"] for stats in results["actions"].values()), 8
+        )
+        self.assertGreater(results["actions"]["create_comment"]["queries"], 0)
+        self.assertGreater(results["messages_per_s"], 0)
+        self.assertGreater(results["peak_rss_mb"], 0)
+
+    def test_concurrent_worker_runs_are_merged(self):
+        def run(elapsed, samples):
+            return {
+                "sockets": 2, "elapsed_s": elapsed, "messages_received": 10, "peak_rss_mb": 50,
+                "latencies": {"create_comment": samples}, "queries": {"list_comments": 1, "create_comment": 3},
+            }
+
+        results = summarize(run(1.0, [1.0, 2.0]), run(2.0, [3.0, 4.0]))
+
+        self.assertEqual((results["workers"], results["sockets"]), (2, 4))
+        self.assertEqual(results["messages_per_s"], 10.0)
+        self.assertEqual(results["actions"]["create_comment"]["count"], 4)
+        self.assertEqual(results["actions"]["create_comment"]["p99_ms"], 4.0)
+        self.assertEqual(results["actions"]["list_comments"]["count"], 0)
+
+
+
+class SyntheticDataTests(TestCase):
+    def test_loaded_threads_are_consistent(self):
+        *_, (users, author_ids) = load_users(20, batch_size=8)
+        totals = list(load_comments(
+            500, author_ids, batch_size=100, seed=1, fanout=3, max_depth=3, max_thread_size=50
+        ))
+
+        self.assertEqual(users, 20)
+        self.assertEqual(totals[-1], 500)
+        self.assertEqual(Comment.objects.count(), 500)
+        self.assertFalse(Comment.objects.filter(reply__isnull=False, root__isnull=True).exists())
+        replies = Comment.objects.filter(reply__isnull=False).select_related("reply")
+        self.assertTrue(replies.exists())
+        for reply in replies:
+            self.assertEqual(reply.root_id, reply.reply.root_id or reply.reply_id)
+            self.assertGreaterEqual(reply.created_at, reply.reply.created_at)
+        for comment in Comment.objects.filter(reply_count__gt=0):
+            children = comment.replies.order_by("-created_at")
+            self.assertEqual(comment.reply_count, children.count())
+            self.assertEqual(comment.last_reply_at, children[0].created_at)
+
+@override_settings(
+    COMMENTS_CONNECTION_THROTTLE_RATES={"create_comment": (0.001, 2), "list_comments": (0.001, 3)},
+    COMMENTS_USER_THROTTLE_RATES={"create_comment": (0.001, 3)},
+    COMMENTS_THROTTLE_CLOSE_AFTER=3,
+)
+class RateLimitTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        throttling._user_buckets.clear()
+        self.user = get_user_model().objects.create_user(
+            username="niaj", email="niaj@example.com", password="Password1"
+        )
+
+    async def test_connection_bucket_rejects_bursts_with_retry_after(self):
+        communicator = await open_socket(self.user)
+        for _ in range(3):
+            await communicator.send_json_to({"action": "list_comments"})
+            await communicator.receive_json_from()
+        await communicator.send_json_to({"action": "list_comments"})
+        response = await communicator.receive_json_from()
+
+        self.assertEqual(response["error"], "Rate limit exceeded")
+        self.assertEqual(response["action"], "list_comments")
+        self.assertGreater(response["retry_after"], 0)
+        await communicator.disconnect()
+
+    async def test_user_bucket_is_shared_between_connections(self):
+        first = await open_socket(self.user)
+        second = await open_socket(self.user)
+        for communicator in (first, first, second):
+            await communicator.send_json_to({"action": "create_comment", "text": "hi"})
+            await communicator.receive_json_from()
+            await first.receive_json_from()
+            await second.receive_json_from()
+
+        await second.send_json_to({"action": "create_comment", "text": "one too many"})
+        response = await second.receive_json_from()
+
+        self.assertEqual(response["error"], "Rate limit exceeded")
+        await first.disconnect()
+        await second.disconnect()
+
+    async def test_repeated_violations_close_the_socket(self):
+        communicator = await open_socket(self.user)
+        for _ in range(5):
+            await communicator.send_json_to({"action": "create_comment", "text": "spam"})
+        messages = []
+        while True:
+            message = await communicator.receive_output()
+            if message["type"] == "websocket.close":
+                break
+            messages.append(message)
+
+        self.assertEqual(message["code"], CommentConsumer.CLOSE_RATE_LIMITED)
+
+
+class PooledDatabaseCallTests(TestCase):
+    async def test_calls_from_different_sockets_overlap(self):
+        threads = set()
+
+        @db.pooled_database_sync_to_async
+        def slow_query():
+            threads.add(threading.current_thread().name)
+            time.sleep(0.2)
+
+        with mock.patch.object(db, "_executor", ThreadPoolExecutor(max_workers=2)):
+            started = time.perf_counter()
+            await asyncio.gather(slow_query(), slow_query())
+            elapsed = time.perf_counter() - started
+
+        self.assertEqual(len(threads), 2)
+        self.assertLess(elapsed, 0.35)
+
+    @override_settings(COMMENTS_DB_WAIT_WARN_MS=50)
+    async def test_waits_for_a_free_thread_are_recorded(self):
+        @db.pooled_database_sync_to_async
+        def slow_query():
+            time.sleep(0.1)
+
+        before = db.db_stats()["executor"]
+        with mock.patch.object(db, "_executor", db.TimedThreadPoolExecutor(max_workers=1)):
+            with self.assertLogs("comments.db", "WARNING"):
+                await asyncio.gather(slow_query(), slow_query())
+        after = db.db_stats()
+
+        self.assertEqual(after["executor"]["calls"] - before["calls"], 2)
+        self.assertEqual(after["executor"]["slow_waits"] - before["slow_waits"], 1)
+        self.assertGreaterEqual(after["executor"]["max_wait_ms"], 50)
+        self.assertEqual(after["pools"], {})
+
+
+class OutboxTests(TestCase):
+    def test_stale_pages_are_coalesced(self):
+        outbox = Outbox(send=None, max_size=10)
+        outbox.push("delta 1")
+        outbox.push("page 1", coalesce="list_comments")
+        outbox.push("delta 2")
+        outbox.push("page 2", coalesce="list_comments")
+
+        self.assertEqual([item[0] for item in outbox.items], ["delta 1", "delta 2", "page 2"])
+
+    def test_overflow_is_reported(self):
+        outbox = Outbox(send=None, max_size=1)
+        outbox.push("delta 1")
+        with self.assertRaises(OutboxFull):
+            outbox.push("delta 2")
+
+
+@override_settings(
+    COMMENTS_BROADCAST_MODE="page",
+    COMMENTS_BROADCAST_WINDOW=0.3,
+    COMMENTS_CONNECTION_THROTTLE_RATES={},
+    COMMENTS_USER_THROTTLE_RATES={},
+)
+class BroadcastCoalescingTests(TransactionTestCase):
+    POSTS = 10
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            username="olivia", email="olivia@example.com", password="Password1"
+        )
+
+    async def test_burst_of_posts_renders_and_sends_per_window(self):
+        poster = await open_socket(self.user)
+        watcher = await open_socket(self.user)
+        with mock.patch.object(
+            CommentConsumer, "fetch_roots", autospec=True, side_effect=CommentConsumer.fetch_roots
+        ) as fetch_roots:
+            for index in range(self.POSTS):
+                await poster.send_json_to({"action": "create_comment", "text": f"burst {index}"})
+            frames = []
+            while not await watcher.receive_nothing(timeout=1):
+                frames.append(await watcher.receive_json_from())
+
+        # One leading and one trailing refresh for the whole burst.
+        self.assertLessEqual(len(frames), 2)
+        self.assertEqual(frames[-1]["comments"][0]["text"], f"burst {self.POSTS - 1}")
+        self.assertLessEqual(fetch_roots.call_count, 2 * len(CommentConsumer.SORTING) * 2)
+        await poster.disconnect()
+        await watcher.disconnect()
+
+    async def test_changing_sort_drops_the_queued_refresh(self):
+        watcher = await open_socket(self.user)
+        pages = await CommentConsumer().render_first_pages()
+        event = {"type": "broadcast_comments", "page": pages["date:desc"]}
+        for _ in range(2):
+            await get_channel_layer().group_send(CommentConsumer.page_group_name("date:desc"), event)
+        await watcher.receive_json_from()
+
+        await watcher.send_json_to({"action": "list_comments", "sort_by": "email", "sort_order": "asc"})
+        await watcher.receive_json_from()
+
+        self.assertTrue(await watcher.receive_nothing(timeout=0.6))
+        await watcher.disconnect()
+
+
+@override_settings(COMMENTS_WRITE_BUFFER_WINDOW=0.05)
+class BufferedWriteTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            username="pia", email="pia@example.com", password="Password1"
+        )
+        self.root = Comment.objects.create(user=self.user, text="root")
+        self.ghost = get_user_model().objects.create_user(
+            username="ghost", email="ghost@example.com", password="Password1"
+        )
+
+    async def test_concurrent_creates_share_one_insert_and_ack_separately(self):
+        first, second, third = [await open_socket(self.user) for _ in range(3)]
+        await first.send_json_to({"action": "subscribe_thread", "root_id": self.root.pk})
+        await first.receive_json_from()
+
+        async with capture_queries() as queries:
+            await first.send_json_to({"action": "create_comment", "text": "a reply", "reply_id": self.root.pk})
+            await second.send_json_to({"action": "create_comment", "text": "lost", "reply_id": 999999})
+            await third.send_json_to({"action": "create_comment", "text": "a root"})
+            saved, *events = [await first.receive_json_from() for _ in range(3)]
+            error = await second.receive_json_from()
+            root_saved = await third.receive_json_from()
+
+        inserts = [sql for sql in queries if sql.startswith("INSERT")]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(error, {"error": "Comment not found"})
+        self.assertEqual({event["comment"]["text"] for event in events}, {"a reply", "a root"})
+        await self.root.arefresh_from_db()
+        self.assertEqual(self.root.reply_count, 1)
+        reply = await Comment.objects.aget(text="a reply")
+        self.assertEqual((reply.root_id, reply.author_username), (self.root.pk, "pia"))
+        reply_event = next(event for event in events if event["comment"]["id"] == reply.pk)
+        self.assertEqual(saved, {
+            "action": "comment_saved", "id": reply.pk, "topic": f"thread:{self.root.pk}",
+            "epoch": reply_event["epoch"], "seq": reply_event["seq"]
+        })
+        root = await Comment.objects.aget(text="a root")
+        self.assertEqual((root_saved["action"], root_saved["id"]), ("comment_saved", root.pk))
+        self.assertEqual(self.root.last_reply_at, reply.created_at)
+        for socket in (first, second, third):
+            await socket.disconnect()
+
+    async def test_a_failing_row_only_fails_its_own_sender(self):
+        good = await open_socket(self.user)
+        bad = await open_socket(self.ghost)
+        await get_user_model().objects.filter(pk=self.ghost.pk).adelete()
+
+        await good.send_json_to({"action": "subscribe_thread", "root_id": self.root.pk})
+        await good.receive_json_from()
+
+        await bad.send_json_to({"action": "create_comment", "text": "from a deleted user"})
+        await good.send_json_to({"action": "create_comment", "text": "a reply", "reply_id": self.root.pk})
+        saved = await good.receive_json_from()
+        event = await good.receive_json_from()
+
+        self.assertEqual(saved["id"], event["comment"]["id"])
+        self.assertEqual(event["comment"]["text"], "a reply")
+        self.assertEqual(await bad.receive_json_from(), {"error": "An error occurred while creating comment."})
+        await self.root.arefresh_from_db()
+        self.assertEqual(self.root.reply_count, 1)
+        self.assertFalse(await Comment.objects.filter(text="from a deleted user").aexists())
+        await good.disconnect()
+        await bad.disconnect()
+
+
+class WriteBufferTests(TestCase):
+    async def test_flushes_when_full_and_returns_each_result(self):
+        batches = []
+
+        async def flush(items):
+            batches.append(items)
+            return [ValueError(item) if item < 0 else item * 2 for item in items]
+
+        buffer = WriteBuffer(60, 3, flush)
+        futures = [buffer.submit(item) for item in (1, -1, 3)]
+        results = await asyncio.gather(*futures, return_exceptions=True)
+
+        self.assertEqual(batches, [[1, -1, 3]])
+        self.assertEqual(results[0], 2)
+        self.assertIsInstance(results[1], ValueError)
+        self.assertEqual(results[2], 6)
+
+    async def test_registry_follows_the_latest_settings_and_flush(self):
+        async def first(items):
+            return items
+
+        async def second(items):
+            return items
+
+        buffer = write_buffer("tests.buffer", 1, 10, first)
+
+        self.assertIs(write_buffer("tests.buffer", 0.5, 5, second), buffer)
+        self.assertEqual((buffer.window, buffer.max_size, buffer.flush), (0.5, 5, second))
+
+    async def test_running_flushes_are_referenced_until_they_finish(self):
+        release = asyncio.Event()
+
+        async def flush(items):
+            await release.wait()
+            return items
+
+        buffer = WriteBuffer(60, 1, flush)
+        future = buffer.submit("item")
+        await asyncio.sleep(0)
+
+        self.assertEqual(len(buffer.tasks), 1)
+        release.set()
+        self.assertEqual(await future, "item")
+        await asyncio.sleep(0)
+        self.assertEqual(buffer.tasks, set())
+
+
+class CoalescerTests(TestCase):
+    async def test_triggers_within_a_window_merge_into_one_trailing_run(self):
+        runs = []
+
+        async def flush():
+            runs.append(asyncio.get_running_loop().time())
+
+        coalescer = Coalescer(0.05, flush)
+        for _ in range(5):
+            coalescer.trigger()
+            await asyncio.sleep(0)
+        await asyncio.sleep(0.1)
+
+        self.assertEqual(len(runs), 2)
+        self.assertGreaterEqual(runs[1] - runs[0], 0.05)
+
+    async def test_group_coalescer_follows_the_latest_window_and_flush(self):
+        async def first():
+            pass
+
+        async def second():
+            pass
+
+        coalescer = group_coalescer("tests.coalescer", 1, first)
+
+        self.assertIs(group_coalescer("tests.coalescer", 0.5, second), coalescer)
+        self.assertEqual((coalescer.window, coalescer.flush), (0.5, second))
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class MetricsTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            username="mia", email="mia@example.com", password="Password1"
+        )
+        metrics.enable()
+        self.addCleanup(metrics.disable)
+
+    async def test_messages_are_timed_with_their_queries(self):
+        before = {
+            "messages": sample("comments_ws_message_seconds_count", action="create_comment"),
+            "queries": sample("comments_ws_message_queries_sum", action="create_comment"),
+            "bytes": sample("comments_ws_outbound_bytes_total", frame="text"),
+            "deliveries": sample("comments_broadcast_deliveries_total", type="comment_created"),
+            "broadcasts": sample("comments_broadcast_groups_sum", type="comment_created"),
+        }
+        socket = await open_socket(self.user)
+        self.assertEqual(sample("comments_ws_connections"), 1)
+
+        await socket.send_json_to({"action": "create_comment", "text": "measured"})
+        await socket.receive_json_from()
+        await socket.receive_json_from()
+        await socket.disconnect()
+
+        self.assertEqual(sample("comments_ws_message_seconds_count", action="create_comment"), before["messages"] + 1)
+        self.assertGreater(sample("comments_ws_message_queries_sum", action="create_comment"), before["queries"])
+        self.assertGreater(sample("comments_ws_outbound_bytes_total", frame="text"), before["bytes"])
+        self.assertEqual(
+            sample("comments_broadcast_groups_sum", type="comment_created"),
+            before["broadcasts"] + len(CommentConsumer.SORTING) * 2
+        )
+        self.assertEqual(
+            sample("comments_broadcast_deliveries_total", type="comment_created"), before["deliveries"] + 1
+        )
+        self.assertEqual(sample("comments_ws_connections"), 0)
+
+    async def test_unknown_actions_share_one_label(self):
+        socket = await open_socket(self.user)
+        before = sample("comments_ws_message_seconds_count", action="unknown")
+        await socket.send_json_to({"action": "no_such_action"})
+        await socket.receive_nothing()
+        await socket.disconnect()
+
+        self.assertEqual(sample("comments_ws_message_seconds_count", action="unknown"), before + 1)
+
+    def test_endpoint_exposes_metrics_only_when_enabled(self):
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"comments_ws_message_seconds", response.content)
+
+        metrics.disable()
+        self.assertEqual(self.client.get("/metrics").status_code, 404)
+
+
+class ReadReplicaTests(TransactionTestCase):
+    """Routes against a second, separately migrated SQLite file that never gets the primary's rows."""
+
+    @classmethod
+    def setUpClass(cls):
+        # The alias is added here rather than declared: the runner would try
+        # to create a test database for it before the settings entry exists.
+        cls.replica_dir = tempfile.mkdtemp()
+        connections.settings["replica"] = {
+            **connections.settings["default"], "NAME": os.path.join(cls.replica_dir, "replica.sqlite3")
+        }
+        call_command("migrate", database="replica", verbosity=0)
+        cls.databases = {"default", "replica"}
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        del cls.databases
+        connections["replica"].close()
+        del connections.settings["replica"]
+        shutil.rmtree(cls.replica_dir, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            username="quinn", email="quinn@example.com", password="Password1"
+        )
+        replicas = override_settings(DATABASE_REPLICAS=["replica"])
+        replicas.enable()
+        self.addCleanup(replicas.disable)
+
+    async def test_reads_stay_on_the_primary_after_a_comment_is_written(self):
+        await Comment.objects.acreate(user=self.user, text="not replicated")
+        communicator = WebsocketCommunicator(CommentConsumer.as_asgi(), "/ws/comments/")
+        communicator.scope["user"] = self.user
+        await communicator.connect()
+        self.assertEqual((await communicator.receive_json_from())["comments"], [])
+
+        await communicator.send_json_to({"action": "create_comment", "text": "mine"})
+        await communicator.receive_json_from()
+        await communicator.receive_json_from()
+        await communicator.send_json_to({"action": "list_comments"})
+        page = await communicator.receive_json_from()
+
+        self.assertEqual([c["text"] for c in page["comments"]], ["mine", "not replicated"])
+        await communicator.disconnect()
+
+    async def test_handshake_falls_back_to_the_primary_for_new_users(self):
+        from jwt_middleware import get_user
+        from user.cache import user_snapshots
+
+        user_snapshots.clear()
+        user = await get_user(str(AccessToken.for_user(self.user)))
+
+        self.assertTrue(user.is_authenticated)
+        self.assertEqual(user.pk, self.user.pk)
+
+    def test_writes_and_migrations_stay_on_the_primary(self):
+        from comments.routers import ReplicaRouter, replica_reads
+
+        router = ReplicaRouter()
+        with replica_reads():
+            self.assertEqual(router.db_for_read(Comment), "replica")
+            self.assertEqual(router.db_for_write(Comment), "default")
+        self.assertEqual(router.db_for_read(Comment), "default")
+        self.assertFalse(router.allow_migrate("replica", "comments"))
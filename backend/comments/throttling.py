@@ -0,0 +1,91 @@
+import asyncio
+import time
+import weakref
+
+import redis.asyncio as redis
+from django.conf import settings
+
+
+# Refills the bucket for the time elapsed since the last call, then takes
+# one token. Returns {allowed, seconds until the next token}.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(now - ts, 0) * rate)
+local allowed = 0
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    retry_after = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return {allowed, tostring(retry_after)}
+"""
+
+_clients = weakref.WeakKeyDictionary()
+# Fallback user buckets when no Redis is configured; shared by every
+# connection in this process only.
+_user_buckets = {}
+
+
+def redis_client():
+    if not settings.COMMENTS_THROTTLE_REDIS_URL:
+        return None
+    loop = asyncio.get_running_loop()
+    if loop not in _clients:
+        _clients[loop] = redis.from_url(settings.COMMENTS_THROTTLE_REDIS_URL)
+    return _clients[loop]
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def consume(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True, 0.0
+        return False, (1 - self.tokens) / self.rate
+
+
+class ConnectionThrottle:
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.buckets = {
+            action: TokenBucket(rate, capacity)
+            for action, (rate, capacity) in settings.COMMENTS_CONNECTION_THROTTLE_RATES.items()
+        }
+
+    async def consume_user(self, action):
+        rate, capacity = settings.COMMENTS_USER_THROTTLE_RATES[action]
+        client = redis_client()
+        if client is None:
+            bucket = _user_buckets.setdefault((action, self.user_id), TokenBucket(rate, capacity))
+            return bucket.consume()
+        allowed, retry_after = await client.eval(
+            TOKEN_BUCKET_SCRIPT, 1, f"comments:throttle:{action}:{self.user_id}", rate, capacity, time.time()
+        )
+        return bool(allowed), float(retry_after)
+
+    async def consume(self, action):
+        if action not in self.buckets:
+            return True, 0.0
+        allowed, retry_after = self.buckets[action].consume()
+        if not allowed:
+            return allowed, retry_after
+        if action in settings.COMMENTS_USER_THROTTLE_RATES:
+            return await self.consume_user(action)
+        return True, 0.0
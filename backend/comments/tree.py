@@ -0,0 +1,64 @@
+from django.db.models import F, Window
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import RowNumber
+
+from comments.models import Comment
+
+
+DESCENDANTS_SQL = """
+WITH RECURSIVE descendants(id) AS (
+    SELECT id FROM {table} WHERE reply_id IN ({roots})
+    UNION ALL
+    SELECT child.id FROM {table} child JOIN descendants ON child.reply_id = descendants.id
+)
+SELECT id FROM descendants
+"""
+
+
+def load_reply_trees(roots, limit=None):
+    roots = list(roots)
+    nodes = {}
+    for root in roots:
+        root.loaded_replies = []
+        nodes[root.id] = root
+    if not roots:
+        return roots
+    if limit is not None:
+        return load_first_replies(roots, nodes, limit)
+
+    descendants_sql = DESCENDANTS_SQL.format(
+        table=Comment._meta.db_table,
+        roots=", ".join(["%s"] * len(roots))
+    )
+    descendants = list(
+        Comment.objects.filter(id__in=RawSQL(descendants_sql, list(nodes))).order_by("id")
+    )
+    for reply in descendants:
+        reply.loaded_replies = []
+        nodes[reply.id] = reply
+    for reply in descendants:
+        nodes[reply.reply_id].loaded_replies.append(reply)
+    return roots
+
+
+def load_first_replies(roots, nodes, limit):
+    # One query per level: the first ``limit`` children of every node on
+    # the level, in the (created_at, id) order load_replies pages through.
+    parents = [node.id for node in roots if node.reply_count]
+    while parents and limit:
+        children = list(
+            Comment.objects.filter(reply_id__in=parents)
+            .annotate(position=Window(
+                RowNumber(),
+                partition_by=F("reply_id"),
+                order_by=[F("created_at").asc(), F("id").asc()]
+            ))
+            .filter(position__lte=limit)
+            .order_by("reply_id", "position")
+        )
+        for child in children:
+            child.loaded_replies = []
+            nodes[child.id] = child
+            nodes[child.reply_id].loaded_replies.append(child)
+        parents = [child.id for child in children if child.reply_count]
+    return roots
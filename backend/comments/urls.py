@@ -0,0 +1,12 @@
+from django.urls import path
+
+from comments.views import CommentPageView, CommentSearchView, CommentThreadView
+
+
+app_name = "comments"
+
+urlpatterns = [
+    path("", CommentPageView.as_view(), name="page"),
+    path("threads/<int:thread_id>/", CommentThreadView.as_view(), name="thread"),
+    path("search/", CommentSearchView.as_view(), name="search"),
+]
@@ -0,0 +1,122 @@
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+
+from rest_framework import views
+from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.response import Response
+
+from comments import metrics
+from comments.consumers import CommentConsumer
+from comments.encoding import JsonEncoding
+from comments.models import Comment
+from comments.page_cache import cached_thread
+from comments.pagination import MAX_PAGE_SIZE, parse_replies_limit
+from comments.routers import reads_from_replica
+from comments.search import search_comments
+from comments.sequence import current_epoch, current_topic_sequences, current_version, thread_topic
+from comments.serializers import comment_to_dict
+from comments.tree import load_reply_trees
+
+
+def parse_positive_int(value, default):
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return default
+    return value if value > 0 else default
+
+
+def replies_limit_param(request):
+    if "replies_limit" in request.query_params:
+        value = request.query_params["replies_limit"]
+        return parse_replies_limit(int(value) if value.isdigit() else value)
+    return settings.COMMENTS_REPLIES_LIMIT
+
+
+def conditional_json(request, etag, render):
+    """
+    304 when the client already holds ``etag``, else the body from ``render()``.
+
+    Sequence numbers only grow within an epoch, so an ETag built from
+    both is checked with a cache read and the database is only touched
+    on a change.
+    """
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(render(), content_type="application/json")
+    response["ETag"] = etag
+    patch_cache_control(response, public=True, max_age=settings.COMMENTS_HTTP_MAX_AGE)
+    return response
+
+
+class PublicReadView(views.APIView):
+    # No user lookup: the responses are the same for everyone, which is
+    # what lets nginx and browsers share them. Author emails are left out.
+    authentication_classes = ()
+    permission_classes = (AllowAny,)
+
+
+class CommentSearchView(views.APIView):
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request):
+        page_size = min(parse_positive_int(request.query_params.get("page_size"), 25), MAX_PAGE_SIZE)
+        results, next_cursor = reads_from_replica(search_comments)(
+            request.query_params.get("q"), page_size, request.query_params.get("cursor")
+        )
+        return Response({"results": results, "next_cursor": next_cursor})
+
+
+class CommentPageView(PublicReadView):
+    """A page of root comments, shaped like the WebSocket list_comments message."""
+
+    def get(self, request):
+        sort_by, sort_order = CommentConsumer.page_key(
+            request.query_params.get("sort_by"), request.query_params.get("sort_order")
+        ).split(":")
+        page = parse_positive_int(request.query_params.get("page"), 1)
+        page_size = min(parse_positive_int(request.query_params.get("page_size"), 25), MAX_PAGE_SIZE)
+        replies_limit = replies_limit_param(request)
+        version = current_version()
+        etag = f'"page-{version[0]}-{version[1]}-{sort_by}-{sort_order}-{page}-{page_size}-{replies_limit}"'
+
+        @reads_from_replica
+        def render():
+            frames, _ = CommentConsumer().render_comments_page(
+                page, page_size, sort_by, sort_order, (JsonEncoding,), replies_limit, version, public=True
+            )
+            return frames[JsonEncoding.name]
+
+        return conditional_json(request, etag, render)
+
+
+class CommentThreadView(PublicReadView):
+    """One root comment with its reply tree."""
+
+    def get(self, request, thread_id):
+        replies_limit = replies_limit_param(request)
+        topic = thread_topic(thread_id)
+        epoch = current_epoch()
+        seq = current_topic_sequences([topic])[topic]
+        etag = f'"thread-{epoch}-{thread_id}-{seq}-{replies_limit}"'
+
+        @reads_from_replica
+        def render():
+            root = Comment.objects.filter(pk=thread_id, reply=None).first()
+            if root is None:
+                raise Http404
+            root, = load_reply_trees([root], replies_limit)
+            return JsonEncoding.encode({
+                "comment": comment_to_dict(root, public=True), "topic": topic, "epoch": epoch, "seq": seq
+            })
+
+        return conditional_json(request, etag, lambda: cached_thread(thread_id, epoch, seq, replies_limit, render))
+
+
+def metrics_view(request):
+    # Scraped from inside the network on each daphne replica; nginx does not route it.
+    if not metrics.enabled:
+        raise Http404
+    body, content_type = metrics.render()
+    return HttpResponse(body, content_type=content_type)
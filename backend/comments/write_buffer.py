@@ -0,0 +1,58 @@
+import asyncio
+
+from comments.loop_registry import per_loop
+
+
+class WriteBuffer:
+    """
+    Collects items for up to ``window`` seconds or ``max_size`` items and
+    hands them to ``flush(items)`` as one batch.
+
+    ``flush`` returns one result per item, either a value or an exception;
+    each submitter gets its own result back from ``submit``.
+    """
+
+    def __init__(self, window, max_size, flush):
+        self.window = window
+        self.max_size = max_size
+        self.flush = flush
+        self.pending = []
+        self.timer = None
+        # The loop only keeps weak references to tasks.
+        self.tasks = set()
+
+    def submit(self, item):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((item, future))
+        if len(self.pending) >= self.max_size:
+            self.flush_pending()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.window, self.flush_pending)
+        return future
+
+    def flush_pending(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, []
+        task = asyncio.get_running_loop().create_task(self.run(batch))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def run(self, batch):
+        try:
+            results = await self.flush([item for item, _ in batch])
+        except Exception as e:
+            results = [e] * len(batch)
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+def write_buffer(name, window, max_size, flush):
+    return per_loop(WriteBuffer, name, window=window, max_size=max_size, flush=flush)
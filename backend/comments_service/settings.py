@@ -126,6 +126,13 @@ SIMPLE_JWT = {
     "ROTATE_REFRESH_TOKENS": False,
 }
 
+# WebSocket handshakes resolve users from an in-process LRU of snapshots.
+# Saves invalidate the local entry and the optional shared cache; other
+# daphne processes drop theirs after JWT_USER_CACHE_TTL seconds at most.
+JWT_USER_CACHE_SIZE = int(os.getenv("JWT_USER_CACHE_SIZE", 10000))
+JWT_USER_CACHE_TTL = int(os.getenv("JWT_USER_CACHE_TTL", 60))
+JWT_USER_CACHE_ALIAS = os.getenv("JWT_USER_CACHE_ALIAS", "") or None
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -147,16 +154,102 @@ WSGI_APPLICATION = 'comments_service.wsgi.application'
 ASGI_APPLICATION = 'comments_service.asgi.application'
 
 
+# Comma-separated Redis URLs. With several hosts channels_redis shards
+# channels and groups across them by consistent hashing, so every ASGI
+# worker must be given the same list in the same order.
+CHANNEL_REDIS_HOSTS = [
+    host.strip()
+    for host in os.getenv(
+        "CHANNEL_REDIS_HOSTS", f"redis://{os.getenv('REDIS_HOST')}:{os.getenv('REDIS_PORT')}/0"
+    ).split(",")
+    if host.strip()
+]
+
 CHANNEL_LAYERS = {
     'default': {
         'BACKEND': 'channels_redis.core.RedisChannelLayer',
         'CONFIG': {
-            "hosts": [(os.getenv('REDIS_HOST'), int(os.getenv('REDIS_PORT')))],
+            "hosts": CHANNEL_REDIS_HOSTS,
+            # Per-channel backlog before group sends to that socket are dropped.
+            "capacity": int(os.getenv("CHANNEL_LAYER_CAPACITY", 300)),
+            # Undelivered messages for sockets that died on another worker
+            # expire quickly instead of holding Redis memory for a minute.
+            "expiry": int(os.getenv("CHANNEL_LAYER_EXPIRY", 10)),
+            "group_expiry": int(os.getenv("CHANNEL_LAYER_GROUP_EXPIRY", 86400)),
         },
     },
 }
 
 
+CACHES = {
+    "default": {
+        "BACKEND": "django_redis.cache.RedisCache",
+        "LOCATION": f"redis://{os.getenv('REDIS_HOST')}:{os.getenv('REDIS_PORT')}/1",
+    }
+}
+
+# "delta" pushes a comment_created event per new comment,
+# "page" re-sends the rendered first page to every socket.
+COMMENTS_BROADCAST_MODE = os.getenv("COMMENTS_BROADCAST_MODE", "delta")
+# In page mode, posts within this many seconds share one render per
+# process and each socket gets at most one refresh per window.
+COMMENTS_BROADCAST_WINDOW = float(os.getenv("COMMENTS_BROADCAST_WINDOW", 0.2))
+
+# Seconds to collect comment creates from all sockets of a process into one
+# insert and one broadcast, flushed early at COMMENTS_WRITE_BUFFER_SIZE.
+# 0 saves every comment on its own.
+COMMENTS_WRITE_BUFFER_WINDOW = float(os.getenv("COMMENTS_WRITE_BUFFER_WINDOW", 0))
+COMMENTS_WRITE_BUFFER_SIZE = int(os.getenv("COMMENTS_WRITE_BUFFER_SIZE", 100))
+
+# Replies loaded per comment in list payloads; the rest are fetched with
+# load_replies. Empty means whole reply trees. Sockets can override it.
+COMMENTS_REPLIES_LIMIT = int(os.getenv("COMMENTS_REPLIES_LIMIT")) if os.getenv("COMMENTS_REPLIES_LIMIT") else None
+
+# Rendered pages are keyed by the comment-set version, so this only bounds
+# how long superseded versions linger in Redis.
+COMMENTS_PAGE_CACHE_TIMEOUT = int(os.getenv("COMMENTS_PAGE_CACHE_TIMEOUT", 300))
+# Cache-Control max-age of the public comment page and thread endpoints;
+# after it clients and nginx revalidate with the ETag.
+COMMENTS_HTTP_MAX_AGE = int(os.getenv("COMMENTS_HTTP_MAX_AGE", 5))
+
+# Uploaded images are decoded and thumbnailed in a process pool; uploads
+# beyond the queue size are rejected instead of waiting.
+COMMENTS_IMAGE_WORKERS = int(os.getenv("COMMENTS_IMAGE_WORKERS", 2))
+COMMENTS_IMAGE_QUEUE_SIZE = int(os.getenv("COMMENTS_IMAGE_QUEUE_SIZE", 16))
+COMMENTS_IMAGE_MAX_BYTES = int(os.getenv("COMMENTS_IMAGE_MAX_BYTES", 5 * 1024 * 1024))
+COMMENTS_UPLOAD_HEADER_MAX_BYTES = int(os.getenv("COMMENTS_UPLOAD_HEADER_MAX_BYTES", 16 * 1024))
+
+# WebSocket token buckets as (tokens per second, burst). Connection buckets
+# live in the consumer, user buckets in Redis so they hold across workers.
+COMMENTS_CONNECTION_THROTTLE_RATES = {
+    "create_comment": (1, 5),
+    "list_comments": (10, 30),
+    "load_replies": (10, 30),
+    "search_comments": (2, 10),
+    "subscribe_thread": (5, 20),
+    "unsubscribe_thread": (5, 20),
+}
+COMMENTS_USER_THROTTLE_RATES = {
+    "create_comment": (2, 10),
+    "list_comments": (20, 60),
+    "load_replies": (20, 60),
+    "search_comments": (5, 20),
+    "subscribe_thread": (10, 40),
+    "unsubscribe_thread": (10, 40),
+}
+COMMENTS_THROTTLE_REDIS_URL = os.getenv(
+    "COMMENTS_THROTTLE_REDIS_URL", f"redis://{os.getenv('REDIS_HOST')}:{os.getenv('REDIS_PORT')}/2"
+)
+COMMENTS_THROTTLE_CLOSE_AFTER = int(os.getenv("COMMENTS_THROTTLE_CLOSE_AFTER", 20))
+COMMENTS_OUTBOX_SIZE = int(os.getenv("COMMENTS_OUTBOX_SIZE", 100))
+# Threads one socket may follow with subscribe_thread on top of its page.
+COMMENTS_MAX_THREAD_SUBSCRIPTIONS = int(os.getenv("COMMENTS_MAX_THREAD_SUBSCRIPTIONS", 50))
+
+# Threads (and so database connections per ASGI process) used for the
+# consumer's queries; sockets only overlap their queries up to this count.
+COMMENTS_DB_WORKERS = int(os.getenv("COMMENTS_DB_WORKERS", 8))
+
+
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.postgresql",
@@ -168,6 +261,46 @@ DATABASES = {
     }
 }
 
+# "persistent" keeps one health-checked connection per thread for
+# DB_CONN_MAX_AGE seconds; "pool" shares a psycopg pool per process,
+# sized for the consumer's database threads plus the request threads.
+DB_CONNECTION_MODE = os.getenv("DB_CONNECTION_MODE", "persistent")
+if DB_CONNECTION_MODE == "pool":
+    DATABASES["default"]["OPTIONS"] = {
+        "pool": {
+            "min_size": int(os.getenv("DB_POOL_MIN_SIZE", 2)),
+            "max_size": COMMENTS_DB_WORKERS + int(os.getenv("DB_POOL_EXTRA_SIZE", 4)),
+            "timeout": float(os.getenv("DB_POOL_TIMEOUT", 10)),
+        }
+    }
+elif DB_CONNECTION_MODE == "persistent":
+    DATABASES["default"]["CONN_MAX_AGE"] = int(os.getenv("DB_CONN_MAX_AGE", 300))
+    DATABASES["default"]["CONN_HEALTH_CHECKS"] = True
+
+# Read replicas with the primary's credentials, as comma-separated host[:port].
+# Page, thread, reply and search reads and the handshake user lookup use them,
+# except within DB_REPLICA_LAG seconds of a comment write (see comments.routers).
+DATABASE_REPLICAS = []
+for index, replica in enumerate(filter(None, os.getenv("DB_REPLICA_HOSTS", "").split(","))):
+    host, _, port = replica.strip().partition(":")
+    alias = f"replica{index}"
+    DATABASES[alias] = {
+        **DATABASES["default"],
+        "HOST": host,
+        "PORT": int(port) if port else DATABASES["default"]["PORT"],
+        "TEST": {"MIRROR": "default"},
+    }
+    DATABASE_REPLICAS.append(alias)
+DATABASE_ROUTERS = ["comments.routers.ReplicaRouter"]
+DB_REPLICA_LAG = float(os.getenv("DB_REPLICA_LAG", 1))
+
+# Pooled database calls that wait longer than this for a free thread are logged.
+COMMENTS_DB_WAIT_WARN_MS = float(os.getenv("COMMENTS_DB_WAIT_WARN_MS", 100))
+
+# Prometheus metrics at /metrics. Processes that share PROMETHEUS_MULTIPROC_DIR
+# (set it before start) are aggregated into one scrape.
+COMMENTS_METRICS_ENABLED = os.getenv("COMMENTS_METRICS_ENABLED", "0") == "1"
+
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
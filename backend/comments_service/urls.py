@@ -19,7 +19,14 @@ from django.conf import settings
 from django.conf.urls.static import static
 from django.urls import path, include
 
+from comments.views import metrics_view
+
 urlpatterns = [
     path("admin/", admin.site.urls),
-    path("user/", include("user.urls"))
+    path("user/", include("user.urls")),
+    path("comments/", include("comments.urls")),
+    path("metrics", metrics_view, name="metrics"),
 ]
+
+# nginx serves /media/ in production; this only applies with DEBUG on.
+urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -1,5 +1,6 @@
+import logging
 import os
-from datetime import datetime
+import time
 
 import django
 
@@ -9,49 +10,51 @@ django.setup()
 import jwt
 from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
-from channels.db import database_sync_to_async
 from channels.middleware import BaseMiddleware
 
-from user.models import CustomUser
-from django.db import close_old_connections
+from comments import metrics
+from comments.db import pooled_database_sync_to_async
+from comments.routers import reads_from_replica
+from user.cache import load_user_snapshot, user_from_snapshot, user_snapshots
 
 ALGORITHM = "HS256"
 
+logger = logging.getLogger(__name__)
 
-@database_sync_to_async
-def get_user(token):
+
+async def get_user(token):
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=ALGORITHM)
-        print('payload', payload)
-    except:
-        print('no payload')
+    except jwt.InvalidTokenError as e:
+        logger.info("websocket token rejected", extra={"reason": str(e)})
         return AnonymousUser()
 
-    token_exp = datetime.fromtimestamp(payload['exp'])
-    if token_exp < datetime.utcnow():
-        print("no date-time")
+    user_id = payload.get("user_id")
+    snapshot = user_snapshots.get(user_id)
+    if snapshot is None:
+        snapshot = await pooled_database_sync_to_async(reads_from_replica(load_user_snapshot))(
+            user_id, payload.get("exp", 0)
+        )
+    if snapshot is None and settings.DATABASE_REPLICAS:
+        # A user who signed up a moment ago may not be on the replica yet.
+        snapshot = await pooled_database_sync_to_async(load_user_snapshot)(user_id, payload.get("exp", 0))
+
+    if snapshot is None or not snapshot["is_active"]:
+        logger.info("websocket user rejected", extra={"user_id": user_id})
         return AnonymousUser()
-
-    try:
-        user = CustomUser.objects.get(id=payload['user_id'])
-        print('user', user)
-    except CustomUser.DoesNotExist:
-        print('no user')
-        return AnonymousUser()
-
-    return user
+    return user_from_snapshot(snapshot)
 
 
 class TokenAuthMiddleware(BaseMiddleware):
 
     async def __call__(self, scope, receive, send):
-        close_old_connections()
+        started = time.perf_counter()
         try:
             token_key = (dict((x.split('=') for x in scope['query_string'].decode().split("&")))).get('token', None)
         except ValueError:
             token_key = None
         scope['user'] = await get_user(token_key)
-        print('d2', scope['user'])
+        metrics.observe_handshake(started, scope['user'].is_authenticated)
         return await super().__call__(scope, receive, send)
 
 
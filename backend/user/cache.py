@@ -0,0 +1,83 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+
+
+SNAPSHOT_FIELDS = ("id", "username", "email", "is_active", "is_staff", "is_superuser")
+
+
+class UserSnapshotCache:
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            expires_at, snapshot = entry
+            if expires_at <= time.time():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return snapshot
+
+    def set(self, user_id, snapshot, expires_at):
+        with self._lock:
+            self._entries[user_id] = (min(expires_at, time.time() + self.ttl), snapshot)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+user_snapshots = UserSnapshotCache(settings.JWT_USER_CACHE_SIZE, settings.JWT_USER_CACHE_TTL)
+
+
+def shared_cache_key(user_id):
+    return f"jwt:user:{user_id}"
+
+
+def shared_cache():
+    if settings.JWT_USER_CACHE_ALIAS:
+        return caches[settings.JWT_USER_CACHE_ALIAS]
+    return None
+
+
+def load_user_snapshot(user_id, expires_at):
+    shared = shared_cache()
+    snapshot = shared.get(shared_cache_key(user_id)) if shared else None
+    if snapshot is None:
+        user = get_user_model().objects.only(*SNAPSHOT_FIELDS).filter(pk=user_id).first()
+        if user is None:
+            return None
+        snapshot = {field: getattr(user, field) for field in SNAPSHOT_FIELDS}
+        if shared:
+            shared.set(shared_cache_key(user_id), snapshot, settings.JWT_USER_CACHE_TTL)
+    user_snapshots.set(user_id, snapshot, expires_at)
+    return snapshot
+
+
+def user_from_snapshot(snapshot):
+    return get_user_model()(**snapshot)
+
+
+def invalidate_user(user_id):
+    user_snapshots.invalidate(user_id)
+    shared = shared_cache()
+    if shared:
+        shared.delete(shared_cache_key(user_id))
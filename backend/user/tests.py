@@ -1,3 +1,82 @@
-from django.test import TestCase
+from contextlib import contextmanager
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.test import TransactionTestCase
+
+from rest_framework_simplejwt.tokens import AccessToken
+
+from comments.db import query_observers
+from jwt_middleware import get_user
+from user.cache import user_snapshots
+
+
+@contextmanager
+def pooled_queries():
+    queries = []
+
+    def observe(execute, sql, params, many, context):
+        queries.append(sql)
+        return execute(sql, params, many, context)
+
+    query_observers.append(observe)
+    try:
+        yield queries
+    finally:
+        query_observers.remove(observe)
+
+
+# Handshakes load users on the pooled database threads, which cannot see
+# the uncommitted data of a TestCase transaction.
+class JwtUserCacheTests(TransactionTestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            username="mallory", email="mallory@example.com", password="Password1"
+        )
+        user_snapshots.clear()
+        self.token = str(AccessToken.for_user(self.user))
+
+    def resolve(self, token):
+        return async_to_sync(get_user)(token)
+
+    def test_repeated_handshakes_skip_the_database(self):
+        with pooled_queries() as first_queries:
+            first = self.resolve(self.token)
+        with pooled_queries() as second_queries:
+            second = self.resolve(self.token)
+
+        self.assertEqual(len(first_queries), 1)
+        self.assertEqual(second_queries, [])
+
+        self.assertEqual(first.pk, self.user.pk)
+        self.assertEqual(second.username, "mallory")
+        self.assertTrue(second.is_authenticated)
+
+    def test_saving_the_user_invalidates_the_snapshot(self):
+        self.resolve(self.token)
+        self.user.username = "mallory2"
+        self.user.save()
+
+        self.assertEqual(self.resolve(self.token).username, "mallory2")
+
+    def test_deactivated_users_are_anonymous(self):
+        self.resolve(self.token)
+        self.user.is_active = False
+        self.user.save()
+
+        self.assertFalse(self.resolve(self.token).is_authenticated)
+
+    def test_invalid_tokens_are_anonymous(self):
+        for token in (None, "garbage", self.token + "x"):
+            self.assertFalse(self.resolve(token).is_authenticated)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = type(user_snapshots)(max_size=2, ttl=60)
+        for user_id in (1, 2, 3):
+            cache.set(user_id, {"id": user_id}, expires_at=float("inf"))
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(cache.get(3), {"id": 3})
+
+    def test_entries_expire_with_the_token(self):
+        user_snapshots.set(self.user.pk, {"id": self.user.pk}, expires_at=0)
+        self.assertIsNone(user_snapshots.get(self.user.pk))